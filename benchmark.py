@@ -0,0 +1,228 @@
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+# Бенчмарк запускает приложение в процессе через TestClient во временном каталоге,
+# поэтому bcrypt ускоряем до импорта main (стоимость читается при импорте)
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+SORT_SIZES = [100, 1_000, 10_000, 100_000]
+SORT_DISTRIBUTIONS = ["random", "sorted", "reversed", "few_unique"]
+USER_COUNTS = [10, 100, 1_000]
+HISTORY_LENGTHS = [10, 100, 1_000, 10_000]
+PARALLEL_SIZES = [1_000_000, 4_000_000]
+PARALLEL_WORKERS = [1, 2, 4, 8]
+
+# Допуски сравнения с эталоном
+TIME_TOLERANCE = 0.5        # замедление больше чем на 50% ...
+MIN_ABS_REGRESSION_MS = 1.0 # ... и больше чем на 1 мс считается регрессией
+EXPONENT_TOLERANCE = 0.3    # рост показателя сложности (t ~ n^k) больше чем на 0.3
+
+
+def make_array(size: int, distribution: str) -> List[int]:
+    if distribution == "sorted":
+        return list(range(size))
+    if distribution == "reversed":
+        return list(range(size, 0, -1))
+    if distribution == "few_unique":
+        return [random.randint(0, 9) for _ in range(size)]
+    return [random.randint(-10 ** 9, 10 ** 9) for _ in range(size)]
+
+
+def measure(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+
+def check(response, status: int = 200):
+    if response.status_code != status:
+        raise RuntimeError(f"{response.request.method} {response.request.url}: {response.status_code} {response.text[:200]}")
+    return response
+
+
+def bench_sort(client, repeat: int, sizes: List[int]) -> Dict[str, float]:
+    results = {}
+    for distribution in SORT_DISTRIBUTIONS:
+        for size in sizes:
+            # Каждый повтор сортирует новый массив: повтор того же массива взял бы результат из кэша
+            # сортировок. sorted/reversed детерминированы, поэтому их значения сдвигаются на номер повтора
+            arrays = iter([[value + i for value in make_array(size, distribution)] for i in range(repeat)])
+            results[f"sort/{distribution}/{size}"] = measure(
+                lambda: check(client.post("/sort", json={"array": next(arrays), "user_login": "bench_sort"})), repeat)
+    return results
+
+
+def bench_login(client, repeat: int, counts: List[int]) -> Dict[str, float]:
+    results = {}
+    created = 0
+    for count in counts:
+        while created < count:
+            check(client.post("/users", json={"login": f"bench_user_{created}", "password": "Bench12345", "role": "bench"}))
+            created += 1
+        login = f"bench_user_{random.randrange(created)}"
+        results[f"login/{count}"] = measure(
+            lambda: check(client.post("/users/login", json={"login": login, "password": "Bench12345"})), repeat)
+    return results
+
+
+def bench_history(client, repeat: int, lengths: List[int]) -> Dict[str, float]:
+    results = {}
+    for length in lengths:
+        login = f"bench_history_{length}"
+        arrays = [make_array(20, "random") for _ in range(length)]
+        for i in range(0, length, 1000):
+            check(client.post("/sort/batch", json={"arrays": arrays[i:i + 1000], "user_login": login}))
+        middle = length // 2
+        results[f"history/get/{length}"] = measure(lambda: check(client.get(f"/history/{login}")), repeat)
+        results[f"arrays/get/{length}"] = measure(
+            lambda: check(client.get(f"/arrays/{login}", params={"start": middle, "end": min(middle + 10, length)})), repeat)
+        results[f"arrays/patch/{length}"] = measure(
+            lambda: check(client.patch(f"/arrays/{login}", params={"position": "end", "element": 1})), repeat)
+        # Удаление сокращает историю, поэтому каждый раз возвращаем массив обратно
+        results[f"arrays/delete/{length}"] = measure(
+            lambda: (check(client.delete(f"/arrays/{login}", params={"index": middle})),
+                     check(client.post("/sort", json={"array": [1], "user_login": login}))), repeat)
+    return results
+
+
+# Ускорение параллельной сортировки по числу процессов. Массив сортируется sort_engine
+# напрямую, без HTTP и JSON, которые заняли бы большую часть времени; 1 — обычный numpy_sort.
+def bench_parallel(repeat: int, sizes: List[int], workers_list: List[int]) -> Dict[str, float]:
+    import sort_engine
+    results = {}
+    for size in sizes:
+        array = make_array(size, "random")
+        for workers in workers_list:
+            sort_engine.PARALLEL_SORT_WORKERS = workers
+            algorithm = "parallel" if workers > 1 else "numpy"
+            results[f"parallel/{workers}/{size}"] = measure(lambda: sort_engine.run_sort(array, algorithm), repeat)
+    return results
+
+
+# Ускорение относительно одного процесса: parallel/1/n / parallel/k/n
+def parallel_speedups(results: Dict[str, float]) -> Dict[str, float]:
+    speedups = {}
+    for key, value in results.items():
+        if not key.startswith("parallel/"):
+            continue
+        _, workers, size = key.split('/')
+        serial = results.get(f"parallel/1/{size}")
+        if workers != "1" and serial and value > 0:
+            speedups[key] = serial / value
+    return speedups
+
+
+# Показатель k в t ~ n^k между крайними точками каждой серии
+def growth_exponents(results: Dict[str, float]) -> Dict[str, float]:
+    series: Dict[str, List[tuple]] = {}
+    for key, value in results.items():
+        name, _, size = key.rpartition('/')
+        series.setdefault(name, []).append((int(size), value))
+    exponents = {}
+    for name, points in series.items():
+        points.sort()
+        (n1, t1), (n2, t2) = points[0], points[-1]
+        if n2 > n1 and t1 > 0 and t2 > 0:
+            exponents[name] = math.log(t2 / t1) / math.log(n2 / n1)
+    return exponents
+
+
+def compare(current: dict, baseline: dict) -> List[str]:
+    regressions = []
+    for key, base in baseline.get("results", {}).items():
+        value = current["results"].get(key)
+        if value is None:
+            continue
+        if value > base * (1 + TIME_TOLERANCE) and value - base > MIN_ABS_REGRESSION_MS:
+            regressions.append(f"{key}: {base:.2f} мс -> {value:.2f} мс")
+    for name, base in baseline.get("exponents", {}).items():
+        value = current["exponents"].get(name)
+        if value is not None and value > base + EXPONENT_TOLERANCE:
+            regressions.append(f"{name}: сложность n^{base:.2f} -> n^{value:.2f}")
+    return regressions
+
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="sort_bench_")
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if "parallel" in args.suites:
+        # пул процессов создаётся один раз, поэтому его размер задаётся до импорта
+        os.environ.setdefault("SORT_WORKERS", str(max(args.parallel_workers)))
+    from fastapi.testclient import TestClient
+    import main
+
+    random.seed(args.seed)
+    results: Dict[str, float] = {}
+    with TestClient(main.app) as client:
+        if "sort" in args.suites:
+            results.update(bench_sort(client, args.repeat, args.sort_sizes))
+        if "login" in args.suites:
+            results.update(bench_login(client, args.repeat, args.user_counts))
+        if "history" in args.suites:
+            results.update(bench_history(client, args.repeat, args.history_lengths))
+    if "parallel" in args.suites:
+        results.update(bench_parallel(args.repeat, args.parallel_sizes, args.parallel_workers))
+    return {"workdir": workdir, "results": results, "exponents": growth_exponents(results),
+            "speedups": parallel_speedups(results)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк сортировки, авторизации и истории")
+    parser.add_argument("--suites", nargs="+", default=["sort", "login", "history"],
+                        help="sort, login, history, parallel (ускорение по числу процессов, запускается явно)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--sort-sizes", type=int, nargs="+", default=SORT_SIZES)
+    parser.add_argument("--user-counts", type=int, nargs="+", default=USER_COUNTS)
+    parser.add_argument("--history-lengths", type=int, nargs="+", default=HISTORY_LENGTHS)
+    parser.add_argument("--parallel-sizes", type=int, nargs="+", default=PARALLEL_SIZES)
+    parser.add_argument("--parallel-workers", type=int, nargs="+", default=PARALLEL_WORKERS)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default="benchmark_baseline.json")
+    parser.add_argument("--update-baseline", action="store_true", help="сохранить результаты как новый эталон")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    output = os.path.join(cwd, args.output)
+    baseline_path = os.path.join(cwd, args.baseline)
+
+    report = run(args)
+    os.chdir(cwd)
+    for key, value in report["results"].items():
+        print(f"{key:<32}{value:>10.2f} мс")
+    for key, value in report["speedups"].items():
+        print(f"ускорение {key:<22}{value:>10.2f}x")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Эталон сохранён в {baseline_path}")
+        return
+
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            regressions = compare(report, json.load(f))
+        if regressions:
+            print("РЕГРЕССИИ ПРОИЗВОДИТЕЛЬНОСТИ:")
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print("Регрессий относительно эталона нет")
+
+
+if __name__ == "__main__":
+    main()
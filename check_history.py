@@ -0,0 +1,150 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+from typing import Dict, List, Union
+from history_store import HistoryStore
+from history_cache import HistoryCache, WRITE_BEHIND, WRITE_THROUGH
+from history_codec import summarize_array
+from lock_manager import LockManager
+from sqlite_store import SqliteDatabase, SqliteHistoryStore
+
+# Проверка хранилищ истории и кэша с отложенной записью: случайная последовательность
+# append/extend/replace/delete/delete_all вперемешку со сбросами кэша, полными чтениями
+# (загрузка в кэш) и компакцией журнала сравнивается с эталонной историей в памяти,
+# а после финального сброса — с содержимым самого хранилища.
+# Запуск: python check_history.py [--steps N] [--seed S]; при расхождении код возврата 1.
+BACKENDS = ["files", "sqlite"]
+MODES = ["none", WRITE_THROUGH, WRITE_BEHIND]
+LOGINS = ["alice", "bob", "carol"]
+# Маленький бюджет кэша, чтобы записи вытеснялись и работали пути при промахе
+CACHE_MAX_ELEMENTS = 300
+
+
+def make_backend(kind: str, folder: str):
+    if kind == "sqlite":
+        return SqliteHistoryStore(SqliteDatabase(os.path.join(folder, 'history.db')))
+    return HistoryStore(os.path.join(folder, 'history/'), LockManager(os.path.join(folder, 'locks/')))
+
+
+def make_array(rnd: random.Random) -> List[int]:
+    array = [rnd.randint(-1000, 1000) for _ in range(rnd.randint(1, 30))]
+    if rnd.random() < 0.05:
+        array.append(2 ** 70)  # значения вне int64 хранятся JSON-записью
+    return array
+
+
+# Сравнение истории (через кэш или напрямую) с эталоном; возвращает описания расхождений.
+# Пустая история и её отсутствие не различаются (SQLite не хранит пустую историю, обработчики
+# проверяют "not count").
+def compare(history, login: str, expected: Union[List[List[int]], None], rnd: random.Random) -> List[str]:
+    errors = []
+    expected = expected or []
+    count = history.count(login)
+    if (count or 0) != len(expected):
+        errors.append(f"count: {count} вместо {len(expected)}")
+        return errors
+    if list(history.iter_all(login)) != expected:
+        errors.append("iter_all не совпадает")
+    if expected:
+        start = rnd.randrange(len(expected))
+        end = rnd.randint(start, len(expected))
+        if history.read_range(login, start, end) != expected[start:end]:
+            errors.append(f"read_range({start}, {end}) не совпадает")
+        position = rnd.randrange(len(expected))
+        if history.get(login, position) != expected[position]:
+            errors.append(f"get({position}) не совпадает")
+    if history.summaries(login) != [summarize_array(array) for array in expected]:
+        errors.append("summaries не совпадают")
+    return errors
+
+
+def check(kind: str, mode: str, steps: int, seed: int) -> List[str]:
+    rnd = random.Random(seed)
+    errors = []
+    with tempfile.TemporaryDirectory() as folder:
+        backend = make_backend(kind, folder)
+        history = backend if mode == "none" else HistoryCache(backend, mode, CACHE_MAX_ELEMENTS)
+        reference: Dict[str, Union[List[List[int]], None]] = {login: None for login in LOGINS}
+        for step in range(steps):
+            login = rnd.choice(LOGINS)
+            arrays = reference[login]
+            op = rnd.choices(["append", "extend", "replace", "delete", "delete_all", "read_all", "flush", "compact"],
+                             weights=[30, 10, 15, 15, 3, 10, 10, 7])[0]
+            if op in ("replace", "delete") and not arrays:
+                op = "append"
+            if op == "append":
+                array = make_array(rnd)
+                position = history.append(login, array)
+                reference[login] = (arrays or []) + [array]
+                if position != len(reference[login]) - 1:
+                    errors.append(f"шаг {step}: append вернул позицию {position}")
+            elif op == "extend":
+                new = [make_array(rnd) for _ in range(rnd.randint(1, 4))]
+                position = history.extend(login, new)
+                if position != len(arrays or []):
+                    errors.append(f"шаг {step}: extend вернул позицию {position}")
+                reference[login] = (arrays or []) + new
+            elif op == "replace":
+                position = rnd.randrange(len(arrays))
+                array = make_array(rnd)
+                history.replace(login, position, array)
+                reference[login] = arrays[:position] + [array] + arrays[position + 1:]
+            elif op == "delete":
+                position = rnd.randrange(len(arrays))
+                deleted = history.delete(login, position)
+                if deleted != arrays[position]:
+                    errors.append(f"шаг {step}: delete({position}) вернул другой массив")
+                reference[login] = arrays[:position] + arrays[position + 1:]
+            elif op == "delete_all":
+                existed = history.delete_all(login)
+                if arrays and not existed:
+                    errors.append(f"шаг {step}: delete_all вернул {existed}")
+                reference[login] = None
+            elif op == "read_all":
+                if history.read_all(login) != (arrays or []):
+                    errors.append(f"шаг {step}: read_all не совпадает")
+            elif op == "flush" and mode == WRITE_BEHIND:
+                history.flush(login)
+            elif op == "compact" and kind == "files":
+                with history.writing(login):
+                    if mode == WRITE_BEHIND:
+                        history.flush(login)
+                    backend.compact(login)
+            errors.extend(f"шаг {step} ({op} {login}): {error}"
+                          for error in compare(history, login, reference[login], rnd))
+            if errors:
+                break
+
+        # После сброса хранилище само должно содержать эталонную историю
+        if mode != "none":
+            history.flush_all()
+        for login in LOGINS:
+            errors.extend(f"хранилище ({login}): {error}"
+                          for error in compare(backend, login, reference[login], rnd))
+        history.shutdown()
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка хранилищ истории и кэша с отложенной записью")
+    parser.add_argument("--steps", type=int, default=2000, help="операций в каждом прогоне")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    args = parser.parse_args()
+
+    failed = False
+    for kind in args.backends:
+        for mode in args.modes:
+            errors = check(kind, mode, args.steps, args.seed)
+            print(f"{kind:<8}{mode:<16}{'ошибки' if errors else 'ок'}")
+            for error in errors[:10]:
+                print(f"    {error}")
+            failed = failed or bool(errors)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
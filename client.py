@@ -1,38 +1,113 @@
 import os
 import json
 import re
+import threading
+from collections import OrderedDict
 import requests
 import random 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from packed import pack_array, unpack_array, unpack_arrays
+
+
+# HTTP-клиент сервера: один requests.Session с пулом keep-alive соединений,
+# таймаутами и повторами с экспоненциальной задержкой для идемпотентных методов.
+# DELETE /arrays удаляет по индексу и не идемпотентен: повтор после обработанного запроса
+# удалил бы другой массив, поэтому для DELETE (как и для POST/PATCH) повторяются только
+# ошибки соединения, когда запрос до сервера не дошёл.
+# binary=True — массивы передаются упакованными int64 вместо JSON.
+# Ответы GET с ETag кэшируются (cache_size последних): повторный запрос отправляет
+# If-None-Match, и при 304 возвращается сохранённый ответ без повторной загрузки тела.
+# Клиент можно использовать из нескольких потоков (loadgen): кэш защищён блокировкой.
+class ApiClient:
+    def __init__(self, base_url="http://localhost:8000", timeout=(3.05, 30), retries=3, backoff=0.3, pool_size=10, binary=False,
+                 cache_size=32):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.binary = binary
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # (путь, параметры, Accept) -> ответ с ETag
+        self._cache_lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.headers["Accept-Encoding"] = "gzip"  # ответы сервера сжимаются, requests распаковывает их сам
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, path, data=None, params=None, content=None, headers=None):
+        if method != 'GET' or not self.cache_size:
+            return self.session.request(method, self.base_url + path, json=data, params=params, data=content,
+                                        headers=headers, timeout=self.timeout)
+
+        headers = dict(headers or {})
+        key = (path, tuple(sorted((params or {}).items())), headers.get("Accept"))
+        with self._cache_lock:
+            cached = self._cache.get(key)
+        if cached is not None:
+            headers["If-None-Match"] = cached.headers["ETag"]
+        response = self.session.get(self.base_url + path, params=params, headers=headers, timeout=self.timeout)
+        with self._cache_lock:
+            if response.status_code == 304 and cached is not None:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                return cached
+            if response.status_code == 200 and "ETag" in response.headers:
+                self._cache[key] = response
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.pop(key, None)
+        return response
 
+    def close(self):
+        self.session.close()
 
 
+api = ApiClient(
+    base_url=os.environ.get("API_BASE_URL", "http://localhost:8000"),
+    timeout=float(os.environ.get("API_TIMEOUT", "30")),
+    binary=os.environ.get("API_BINARY") == "1",
+    cache_size=int(os.environ.get("API_CACHE_SIZE", "32")),
+)
 
-def send_request(method, url, data=None, params=None):
-    response = None
-    if method == 'POST':
-        response = requests.post(url, json=data)
-    elif method == 'GET':
-        response = requests.get(url, params=params)
-    elif method == 'DELETE':
-        response = requests.delete(url, params=params)
-    elif method == 'PATCH':
-        response = requests.patch(url, params=params, json=data)
-    
-    if response is None:
+
+def send_request(method, path, data=None, params=None):
+    if method not in ('POST', 'GET', 'DELETE', 'PATCH'):
         raise ValueError(f"Unsupported HTTP method: {method}")
-    
+
+    # Тело передаётся только в POST и PATCH
+    response = api.request(method, path, data=data if method in ('POST', 'PATCH') else None, params=params)
+
     try:
         return response.json()
     except ValueError:
         return response.text
 
-def send_post(url, data):
-    
-    response = requests.post(url, json=data)  # Передаем данные в формате JSON
-    try:
-        return response.json()  # Преобразуем ответ в JSON
-    except ValueError:
-        return response.text  # Если не JSON, возвращаем как текст
+def send_post(path, data):
+    return send_request('POST', path, data)
+
+# Сортировка на сервере; в двоичном режиме массив и ответ передаются как int64
+def request_sort(array, user_login):
+    if not api.binary:
+        return send_post("/sort", {"array": array, "user_login": user_login})
+
+    response = api.request('POST', "/sort", params={"user_login": user_login}, content=pack_array(array),
+                           headers={"Content-Type": "application/octet-stream", "Accept": "application/octet-stream"})
+    # Сервер отвечает JSON при ошибке или если значения не помещаются в int64
+    if not response.headers.get("Content-Type", "").startswith("application/octet-stream"):
+        try:
+            return response.json()
+        except ValueError:
+            return response.text
+    return {"sorted_array": unpack_array(response.content), "algorithm": response.headers.get("X-Sort-Algorithm")}
 
 def gnome_sort_client(user_login):
     print("Выберите способ создания массива:")
@@ -63,8 +138,7 @@ def gnome_sort_client(user_login):
         print("Неверный выбор")
         return None
 
-    data = {"array": array, "user_login": user_login}
-    result = send_post(f"http://localhost:8000/sort", data)
+    result = request_sort(array, user_login)
 
     if isinstance(result, dict) and "sorted_array" in result:
         return result['sorted_array']
@@ -84,7 +158,7 @@ def auth():
         "password": password
     }
 
-    result = send_post(f"http://localhost:8000/users/login", user_data)
+    result = send_post("/users/login", user_data)
     if "token" in result:
         return {"login": login, "token": result["token"]}
     else:
@@ -129,7 +203,7 @@ def registration():
     }
 
     # Прямо передаем словарь в запрос, без использования json.dumps()
-    result = send_post(f"http://127.0.0.1:8000/users", user_data)
+    result = send_post("/users", user_data)
     print(result)
 
 
@@ -159,23 +233,49 @@ def save_sorted_array(user_login, sorted_arr):
     print(f"Массив добавлен в историю пользователя {user_login}")
 
 
+# Постраничное чтение истории: следующая страница запрашивается,
+# только когда закончились массивы текущей
+def iter_history(user_login, page_size=100):
+    url = f"/history/{user_login}"
+    cursor = 0
+    while cursor is not None:
+        params = {"cursor": cursor, "limit": page_size}
+        if api.binary:
+            response = api.request('GET', url, params=params, headers={"Accept": "application/octet-stream"})
+            if response.status_code != 200:
+                raise ValueError(response.text)
+            if not response.headers.get("Content-Type", "").startswith("application/octet-stream"):
+                result = response.json()
+                yield from result["history"]
+                cursor = result.get("next_cursor")
+                continue
+            yield from unpack_arrays(response.content)
+            next_cursor = response.headers.get("X-Next-Cursor")
+            cursor = int(next_cursor) if next_cursor is not None else None
+            continue
+
+        result = send_request('GET', url, params=params)
+        if not (isinstance(result, dict) and "history" in result):
+            raise ValueError(result)
+        yield from result["history"]
+        cursor = result.get("next_cursor")
+
+
 def view_history( user_login):
     if not  user_login:
         print("Ошибка: Логин пользователя не указан.")
         return
-    url = f"http://localhost:8000/history/{user_login}"
-    result = send_request('GET', url, {})
-    print("Результат запроса:", result)
-    if isinstance(result, dict) and "history" in result:
-        history = result["history"]
-        if history:
-            print(f"История сортировок для пользователя {user_login}:")
-            for i, arr in enumerate(history, 1):
-                print(f"{i}: {arr}")
-        else:
+    try:
+        empty = True
+        for i, arr in enumerate(iter_history(user_login), 1):
+            if empty:
+                print(f"История сортировок для пользователя {user_login}:")
+                empty = False
+            print(f"{i}: {arr}")
+        if empty:
             print(f"История сортировок пуста для пользователя {user_login}.")
-    else:
-        print("Ошибка при получении истории сортировок.")
+    except ValueError as e:
+        print("Ошибка при получении истории сортировок:", e)
 
 
 def create_array(user_login):
@@ -193,7 +293,7 @@ def create_array(user_login):
 def delete_array(user_login):
     try:
         index = int(input("Введите номер массива для удаления: ")) - 1
-        url = f"http://127.0.0.1:8000/arrays/{user_login}"
+        url = f"/arrays/{user_login}"
         result = send_request('DELETE', url, params={"index": index})
 
         if isinstance(result, dict) and "deleted_array" in result:
@@ -204,7 +304,7 @@ def delete_array(user_login):
         print("Неверный ввод. Пожалуйста, введите номер массива.")
 
 def delete_history(user_login):
-    url = f"http://127.0.0.1:8000/history/{user_login}"
+    url = f"/history/{user_login}"
     result = send_request('DELETE', url, {})
     if isinstance(result, dict) and "message" in result:
         print(result["message"])
@@ -234,7 +334,7 @@ def change_password_client(user_login):
         "new_password": new_password
     }
 
-    url = "http://localhost:8000/users/password"
+    url = "/users/password"
     result = send_request('PATCH', url, data)
 
     if isinstance(result, dict) and "message" in result:
@@ -253,15 +353,16 @@ def update_array_client(user_login):
     print("1 - В начало")
     print("2 - В конец")
     print("3 - После определенного индекса")
+    print("4 - С сохранением сортировки")
 
     try:
         position_choice = int(input("Ваш выбор: "))
     except ValueError:
-        print("Ошибка: Введите число от 1 до 3.")
+        print("Ошибка: Введите число от 1 до 4.")
         return
 
-    if position_choice not in [1, 2, 3]:
-        print("Ошибка: Неверный выбор. Введите 1, 2 или 3.")
+    if position_choice not in [1, 2, 3, 4]:
+        print("Ошибка: Неверный выбор. Введите 1, 2, 3 или 4.")
         return
 
     position = ""
@@ -276,27 +377,34 @@ def update_array_client(user_login):
         position = "after"
     elif position_choice == 1:
         position = "start"
+    elif position_choice == 4:
+        position = "sorted"
     else:
         position = "end"
 
     try:
-        element = int(input("Введите число для добавления: "))
+        elements = [int(x) for x in input("Введите числа для добавления через пробел: ").split()]
     except ValueError:
-        print("Ошибка: Введите целое число.")
+        print("Ошибка: Введите целые числа.")
+        return
+    if not elements:
+        print("Ошибка: Введите хотя бы одно число.")
         return
 
-    # Формируем query-параметры
-    params = {
-        "position": position,
-        "element": element
-    }
+    params = {}
     if index is not None:
         params["index"] = index
 
-    url = f"http://127.0.0.1:8000/arrays/{user_login}"
-    
-    # Отправляем параметры в URL (params=params)
-    result = send_request('PATCH', url, params=params)
+    url = f"/arrays/{user_login}"
+
+    if len(elements) == 1:
+        # Один элемент — в query-параметрах
+        params["position"] = position
+        params["element"] = elements[0]
+        result = send_request('PATCH', url, params=params)
+    else:
+        # Несколько элементов — телом запроса
+        result = send_request('PATCH', url, data={"position": position, "element": elements}, params=params)
 
     if isinstance(result, dict) and "updated_array" in result:
         print(f"Обновленный массив: {result['updated_array']}")
@@ -311,7 +419,7 @@ def get_array_slice_client(user_login):
         end = int(input("Введите конечный индекс: "))
 
         # Формируем URL для запроса
-        url = f"http://127.0.0.1:8000/arrays/{user_login}"
+        url = f"/arrays/{user_login}"
         
         # Параметры запроса (start и end передаются как query-параметры)
         params = {"start": start, "end": end}
@@ -328,7 +436,7 @@ def get_array_slice_client(user_login):
         print("Ошибка: Введите корректные числовые значения для индексов.")
 
 def logout_client(user_login):
-    url = "http://localhost:8000/users/logout"
+    url = "/users/logout"
     data = {"login": user_login}
     result = send_request('POST', url, data)
     if isinstance(result, dict) and "message" in result:
@@ -337,62 +445,65 @@ def logout_client(user_login):
         print("Ошибка при выходе из системы.")
 
 # Основной цикл программы
-while True:
-    print("\nГлавное меню:")
-    print("1 - Авторизация")
-    print("2 - Регистрация")
-    print("3 - Выход из программы")
-    main_command = input("Введите номер команды: ")
-
-    if main_command == "1":
-        # Авторизация
-        user = auth()
-        if not user:
-            continue
-
-        # Цикл работы после успешной авторизации
-        while True:
-            print(f"\nДобро пожаловать, {user['login']}!")
-            print("1 - Ввести массив для сортировки")
-            print("2 - Просмотреть историю сортировок")
-            print("3 - Удалить массив из истории")
-            print("4 - Удалить всю историю")
-            print("5 - Сменить пароль")
-            print("6 - Изменить массив")
-            print("7 - Получить срез массива")
-            print("8 - Выйти из системы")
-
-            user_command = input("Введите номер команды: ")
-
-            if user_command == "1":
-                create_array(user['login'])
-            elif user_command == "2":
-                view_history(user['login'])
-            elif user_command == "3":
-                delete_array(user['login'])
-            elif user_command == "4":
-                delete_history(user['login'])
-            elif user_command == "5":
-                change_password_client(user['login'])
-            elif user_command == "6":
-                update_array_client(user['login'])
-            elif user_command == "7":
-                get_array_slice_client(user['login'])
-            elif user_command == "8":
-                logout_client(user['login'])
-                user = None
-                break  # Выход в главное меню
-            else:
-                print("Неверная команда!")
-
-    elif main_command == "2":
-        # Регистрация
-        registration()
+def main():
+    while True:
+        print("\nГлавное меню:")
+        print("1 - Авторизация")
+        print("2 - Регистрация")
+        print("3 - Выход из программы")
+        main_command = input("Введите номер команды: ")
+
+        if main_command == "1":
+            # Авторизация
+            user = auth()
+            if not user:
+                continue
+
+            # Цикл работы после успешной авторизации
+            while True:
+                print(f"\nДобро пожаловать, {user['login']}!")
+                print("1 - Ввести массив для сортировки")
+                print("2 - Просмотреть историю сортировок")
+                print("3 - Удалить массив из истории")
+                print("4 - Удалить всю историю")
+                print("5 - Сменить пароль")
+                print("6 - Изменить массив")
+                print("7 - Получить срез массива")
+                print("8 - Выйти из системы")
+
+                user_command = input("Введите номер команды: ")
+
+                if user_command == "1":
+                    create_array(user['login'])
+                elif user_command == "2":
+                    view_history(user['login'])
+                elif user_command == "3":
+                    delete_array(user['login'])
+                elif user_command == "4":
+                    delete_history(user['login'])
+                elif user_command == "5":
+                    change_password_client(user['login'])
+                elif user_command == "6":
+                    update_array_client(user['login'])
+                elif user_command == "7":
+                    get_array_slice_client(user['login'])
+                elif user_command == "8":
+                    logout_client(user['login'])
+                    user = None
+                    break  # Выход в главное меню
+                else:
+                    print("Неверная команда!")
+
+        elif main_command == "2":
+            # Регистрация
+            registration()
     
-    elif main_command == "3":
-        print("Выход из программы...")
-        break
-    else:
-        print("Неверная команда!")
+        elif main_command == "3":
+            print("Выход из программы...")
+            break
+        else:
+            print("Неверная команда!")
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+from contextlib import contextmanager
+from typing import Iterator, List
+import heapq
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from storage import load_json, save_json
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: без него загрузки по частям недоступны
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: загрузки защищены только внутри одного процесса
+    fcntl = None
+
+# Внешняя сортировка загружаемых по частям массивов
+UPLOADS_FOLDER = os.environ.get("UPLOADS_FOLDER", "uploads/")
+# Сколько элементов сортировать в памяти за раз (размер отрезка) и держать в памяти при слиянии
+UPLOAD_BUFFER_ELEMENTS = int(os.environ.get("UPLOAD_BUFFER_ELEMENTS", "4000000"))
+UPLOAD_CHUNK_MAX_ELEMENTS = int(os.environ.get("UPLOAD_CHUNK_MAX_ELEMENTS", "1000000"))
+UPLOAD_TTL = float(os.environ.get("UPLOAD_TTL", "3600"))  # брошенные загрузки старше удаляются
+# Результат, сохраняемый в историю, собирается в памяти целиком — его размер ограничен отдельно
+UPLOAD_STORE_MAX_ELEMENTS = int(os.environ.get("UPLOAD_STORE_MAX_ELEMENTS", "10000000"))
+# Слияние за один проход: не больше UPLOAD_MERGE_MAX_FAN_IN открытых отрезков и не меньше
+# UPLOAD_MERGE_MIN_BLOCK элементов на блок отрезка (буфер делится между отрезками);
+# если отрезков больше, они сливаются в несколько проходов
+UPLOAD_MERGE_MAX_FAN_IN = int(os.environ.get("UPLOAD_MERGE_MAX_FAN_IN", "64"))
+UPLOAD_MERGE_MIN_BLOCK = int(os.environ.get("UPLOAD_MERGE_MIN_BLOCK", "8192"))
+
+EXTERNAL_SORT_AVAILABLE = np is not None
+DTYPE = np.dtype('<i8') if np is not None else None
+_UPLOAD_ID = re.compile(r'[0-9a-f]{32}')
+
+OPEN = "open"
+FINALIZED = "finalized"
+
+
+class UploadNotFound(Exception):
+    pass
+
+
+class UploadClosed(Exception):
+    pass
+
+
+# Отрезок на диске, читаемый блоками
+class _Run:
+    def __init__(self, path: str, block_elements: int):
+        self.file = open(path, 'rb')
+        self.block_bytes = block_elements * DTYPE.itemsize
+        self.block = np.empty(0, dtype=DTYPE)
+
+    def refill(self) -> bool:
+        self.block = np.frombuffer(self.file.read(self.block_bytes), dtype=DTYPE)
+        return len(self.block) > 0
+
+    def close(self):
+        self.file.close()
+
+
+# Слияние k отсортированных отрезков. Куча хранит последний элемент текущего блока
+# каждого отрезка; наименьший из них (граница) гарантирует, что все элементы блоков
+# не больше границы можно выдать сразу: они срезаются searchsorted и сливаются NumPy.
+# Отрезки с исчерпанным блоком — на вершине кучи, их блоки подчитываются.
+def merge_runs(paths: List[str], buffer_elements: int) -> Iterator["np.ndarray"]:
+    block_elements = max(1, buffer_elements // (len(paths) + 1))
+    runs = [_Run(path, block_elements) for path in paths]
+    try:
+        heap = [(int(run.block[-1]), i) for i, run in enumerate(runs) if run.refill()]
+        heapq.heapify(heap)
+        while heap:
+            bound = heap[0][0]
+            pieces = []
+            for run in runs:
+                if len(run.block):
+                    cut = int(np.searchsorted(run.block, bound, side='right'))
+                    if cut:
+                        pieces.append(run.block[:cut])
+                        run.block = run.block[cut:]
+            while heap and not len(runs[heap[0][1]].block):
+                _, i = heapq.heappop(heap)
+                if runs[i].refill():
+                    heapq.heappush(heap, (int(runs[i].block[-1]), i))
+            yield pieces[0] if len(pieces) == 1 else np.sort(np.concatenate(pieces), kind='mergesort')
+    finally:
+        for run in runs:
+            run.close()
+
+
+def merge_fan_in(buffer_elements: int) -> int:
+    return max(2, min(UPLOAD_MERGE_MAX_FAN_IN, buffer_elements // UPLOAD_MERGE_MIN_BLOCK - 1))
+
+
+# Сеанс загрузки: uploads/{upload_id}/ с meta.json, буфером pending.bin (ещё не отсортированные
+# элементы, int64 little-endian) и отсортированными отрезками run_N.bin.
+# Когда буфер набирает UPLOAD_BUFFER_ELEMENTS элементов, он сортируется и сбрасывается в отрезок,
+# поэтому память не зависит от длины массива. Всё состояние на диске, части одной загрузки
+# могут приходить в разные воркеры uvicorn; операции с загрузкой идут под flock на файле
+# lock в её каталоге, который удаляется вместе с загрузкой.
+class ExternalSorter:
+    def __init__(self, folder_path: str = UPLOADS_FOLDER, buffer_elements: int = UPLOAD_BUFFER_ELEMENTS):
+        self.folder_path = folder_path
+        self.buffer_elements = buffer_elements
+        self._lock = threading.Lock()  # без fcntl
+
+    def _path(self, upload_id: str, name: str = '') -> str:
+        if not _UPLOAD_ID.fullmatch(upload_id):
+            raise UploadNotFound(upload_id)
+        return os.path.join(self.folder_path, upload_id, name)
+
+    @contextmanager
+    def _locked(self, upload_id: str):
+        if fcntl is None:
+            with self._lock:
+                yield
+            return
+        try:
+            handle = open(self._path(upload_id, 'lock'), 'a')
+        except FileNotFoundError:
+            raise UploadNotFound(upload_id)
+        with handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            yield
+
+    def _meta(self, upload_id: str) -> dict:
+        meta = load_json(self._path(upload_id, 'meta.json'))
+        if meta is None:
+            raise UploadNotFound(upload_id)
+        return meta
+
+    def create(self, user_login: str) -> dict:
+        self.cleanup()
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._path(upload_id))
+        meta = {"upload_id": upload_id, "user_login": user_login, "status": OPEN,
+                "elements": 0, "runs": 0, "created": time.time()}
+        save_json(self._path(upload_id, 'meta.json'), meta)
+        return meta
+
+    # Добавление части: data — элементы в int64 little-endian
+    def add_chunk(self, upload_id: str, data: bytes) -> dict:
+        with self._locked(upload_id):
+            meta = self._meta(upload_id)
+            if meta["status"] != OPEN:
+                raise UploadClosed(upload_id)
+            pending_path = self._path(upload_id, 'pending.bin')
+            with open(pending_path, 'ab') as pending:
+                pending.write(data)
+                pending_bytes = pending.tell()
+            meta["elements"] += len(data) // DTYPE.itemsize
+            if pending_bytes >= self.buffer_elements * DTYPE.itemsize:
+                self._spill(meta)
+            save_json(self._path(upload_id, 'meta.json'), meta)
+        return meta
+
+    # Сортировка буфера в очередной отрезок
+    def _spill(self, meta: dict):
+        pending_path = self._path(meta["upload_id"], 'pending.bin')
+        try:
+            with open(pending_path, 'rb') as pending:
+                values = np.frombuffer(pending.read(), dtype=DTYPE)
+        except FileNotFoundError:
+            return
+        if len(values):
+            run_path = self._path(meta["upload_id"], f'run_{meta["runs"]}.bin')
+            with open(run_path + '.tmp', 'wb') as run:
+                run.write(np.sort(values).astype(DTYPE, copy=False).tobytes())
+            os.replace(run_path + '.tmp', run_path)
+            meta["runs"] += 1
+        os.remove(pending_path)
+
+    # Предварительные проходы слияния: группы по fan_in отрезков сливаются в новые отрезки,
+    # пока для последнего прохода их не останется не больше fan_in
+    def _reduce_runs(self, meta: dict, paths: List[str]) -> List[str]:
+        fan_in = merge_fan_in(self.buffer_elements)
+        while len(paths) > fan_in:
+            merged = []
+            for i in range(0, len(paths), fan_in):
+                group = paths[i:i + fan_in]
+                if len(group) == 1:
+                    merged.append(group[0])
+                    continue
+                run_path = self._path(meta["upload_id"], f'run_{meta["runs"]}.bin')
+                meta["runs"] += 1
+                with open(run_path + '.tmp', 'wb') as run:
+                    for block in merge_runs(group, self.buffer_elements):
+                        run.write(block.tobytes())
+                os.replace(run_path + '.tmp', run_path)
+                for path in group:
+                    os.remove(path)
+                merged.append(run_path)
+            paths = merged
+        return paths
+
+    # Завершение загрузки: остаток буфера сбрасывается в отрезок, лишние отрезки сливаются
+    # предварительными проходами, загрузка закрывается для новых частей.
+    # Возвращает meta и генератор отсортированных блоков (np.ndarray);
+    # по окончании чтения каталог загрузки удаляется.
+    def finalize(self, upload_id: str):
+        with self._locked(upload_id):
+            meta = self._meta(upload_id)
+            if meta["status"] != OPEN:
+                raise UploadClosed(upload_id)
+            self._spill(meta)
+            paths = self._reduce_runs(meta, [self._path(upload_id, f'run_{i}.bin') for i in range(meta["runs"])])
+            meta["status"] = FINALIZED
+            save_json(self._path(upload_id, 'meta.json'), meta)
+        return meta, self._merged(upload_id, paths)
+
+    def _merged(self, upload_id: str, paths: List[str]) -> Iterator["np.ndarray"]:
+        try:
+            yield from merge_runs(paths, self.buffer_elements)
+        finally:
+            self.abort(upload_id)
+
+    def get(self, upload_id: str) -> dict:
+        return self._meta(upload_id)
+
+    def abort(self, upload_id: str) -> bool:
+        path = self._path(upload_id)
+        if not os.path.isdir(path):
+            return False
+        shutil.rmtree(path, ignore_errors=True)
+        return True
+
+    # Удаление загрузок, в которые ничего не добавлялось дольше UPLOAD_TTL (meta.json пишется при каждой части)
+    def cleanup(self):
+        if not os.path.isdir(self.folder_path):
+            return
+        now = time.time()
+        for upload_id in os.listdir(self.folder_path):
+            if not _UPLOAD_ID.fullmatch(upload_id):
+                continue
+            try:
+                modified = os.path.getmtime(self._path(upload_id, 'meta.json'))
+            except FileNotFoundError:
+                modified = 0
+            if now - modified > UPLOAD_TTL:
+                self.abort(upload_id)
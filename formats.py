@@ -0,0 +1,84 @@
+from typing import Any, Callable, Union
+import json
+from fastapi import Request, Response
+from packed import pack_array, unpack_array, pack_arrays, unpack_arrays
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен: без него используется стандартный json
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack необязателен: без него формат недоступен
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+BINARY = "application/octet-stream"
+
+
+def dumps_json(payload: Any) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload)
+        except TypeError:  # например, целые больше 64 бит
+            pass
+    return json.dumps(payload).encode()
+
+
+# Класс ответа по умолчанию: JSON через orjson, если он установлен
+class FastJSONResponse(Response):
+    media_type = JSON
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+
+def _media_type(header: Union[str, None]) -> str:
+    return (header or "").split(';')[0].strip().lower()
+
+def body_format(request: Request) -> str:
+    media_type = _media_type(request.headers.get("content-type"))
+    if media_type in (MSGPACK, "application/x-msgpack"):
+        return MSGPACK
+    if media_type == BINARY:
+        return BINARY
+    return JSON
+
+def response_format(request: Request) -> str:
+    accept = [_media_type(part) for part in request.headers.get("accept", "").split(',')]
+    for media_type in accept:
+        if media_type == BINARY:
+            return BINARY
+        if media_type in (MSGPACK, "application/x-msgpack") and msgpack is not None:
+            return MSGPACK
+        if media_type in (JSON, "*/*"):
+            return JSON
+    return JSON
+
+# Разбор JSON/msgpack тела в словарь. JSON разбирается стандартным модулем:
+# orjson превращает целые больше 64 бит в float, а они допустимы в List[int]
+def decode_body(data: bytes, media_type: str) -> Any:
+    if media_type == MSGPACK:
+        if msgpack is None:
+            raise ValueError("msgpack is not installed on the server")
+        return msgpack.unpackb(data)
+    return json.loads(data)
+
+
+# Ответ в формате, запрошенном в Accept. binary строит упакованное тело;
+# если его нет, двоичный формат для маршрута не поддерживается и отдаётся JSON.
+def respond(request: Request, payload: Any, binary: Union[Callable[[], bytes], None] = None, headers=None) -> Response:
+    media_type = response_format(request)
+    if media_type == BINARY and binary is not None:
+        try:
+            return Response(binary(), media_type=BINARY, headers=headers)
+        except OverflowError:  # значения не помещаются в int64 — отдаём JSON
+            pass
+    if media_type == MSGPACK:
+        try:
+            return Response(msgpack.packb(payload), media_type=MSGPACK, headers=headers)
+        except OverflowError:  # msgpack не кодирует целые вне int64/uint64 — отдаём JSON
+            pass
+    return FastJSONResponse(payload, headers=headers)
@@ -0,0 +1,387 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Union
+import os
+import threading
+from storage import HistoryBackend
+from history_codec import summarize_array
+from metrics import metrics
+
+# Сколько элементов (чисел во всех массивах плюс по одному на массив) держать в кэше
+HISTORY_CACHE_MAX_ELEMENTS = int(os.environ.get("HISTORY_CACHE_MAX_ELEMENTS", "5000000"))
+# Отложенная запись: сброс изменений раз в HISTORY_FLUSH_INTERVAL секунд
+# или раньше, когда несброшенных элементов больше HISTORY_FLUSH_DIRTY_ELEMENTS
+HISTORY_FLUSH_INTERVAL = float(os.environ.get("HISTORY_FLUSH_INTERVAL", "1.0"))
+HISTORY_FLUSH_DIRTY_ELEMENTS = int(os.environ.get("HISTORY_FLUSH_DIRTY_ELEMENTS", "1000000"))
+
+WRITE_BEHIND = "write-behind"
+WRITE_THROUGH = "write-through"
+
+
+class _Entry:
+    def __init__(self, arrays: Union[List[List[int]], None], persisted: int):
+        self.arrays = arrays        # вся история; None — не загружена, в записи только дозаписи
+        self.appended = []          # дозаписанные массивы незагруженной истории
+        self.missing = False        # история удалена (удаление ещё не сброшено)
+        self.elements = _size(arrays)
+        self.pins = 0               # обработчики, работающие с записью; такие записи не вытесняются
+        # Несброшенные изменения (только для отложенной записи):
+        self.dirty = False
+        self.persisted = persisted  # первые persisted массивов лежат в хранилище на своих позициях
+        self.replaced = set()       # позиции из них, перезаписанные в кэше
+        self.rewrite = False        # позиции сдвинулись — историю нужно переписать целиком
+        self.dirty_elements = 0
+
+    def count(self) -> Union[int, None]:
+        if self.missing:
+            return None
+        if self.arrays is None:
+            return self.persisted + len(self.appended)
+        return len(self.arrays)
+
+
+def _size(arrays: Union[List[List[int]], None]) -> int:
+    return sum(len(array) + 1 for array in arrays) if arrays else 0
+
+
+# Кэш истории недавно активных пользователей поверх любого хранилища истории.
+# Размер ограничен суммарным числом элементов, вытесняются давно не использованные (LRU).
+# История попадает в кэш при полном чтении (read_all), если она не больше бюджета;
+# остальные чтения при промахе идут в хранилище (срезы и потоковая отдача остаются ленивыми).
+# write-through: изменения сразу пишутся в хранилище и в закэшированную историю.
+# write-behind: изменения копятся в кэше и сбрасываются фоновым потоком одной записью
+# на пользователя (несколько дозаписей — одним extend), а также при остановке.
+# Дозаписи к незагруженной истории копятся без её чтения; перезапись и удаление в ней
+# сначала сбрасывают дозаписи и выполняются в хранилище.
+# Кэш свой у каждого процесса, поэтому он выключен по умолчанию (HISTORY_CACHE=off)
+# и включается только при одном воркере uvicorn.
+class HistoryCache(HistoryBackend):
+    def __init__(self, backend: HistoryBackend, mode: str = WRITE_BEHIND,
+                 max_elements: int = HISTORY_CACHE_MAX_ELEMENTS):
+        if mode not in (WRITE_BEHIND, WRITE_THROUGH):
+            raise ValueError(f"Unknown history cache mode: {mode}")
+        self.backend = backend
+        self.locks = backend.locks
+        self.mode = mode
+        self.max_elements = max_elements
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.elements = 0
+        self.dirty_elements = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self._flush_needed = threading.Event()
+        self._stopped = False
+        self._flusher = None
+
+    @contextmanager
+    def reading(self, login: str):
+        with self.backend.reading(login):
+            yield
+
+    @contextmanager
+    def writing(self, login: str):
+        with self.backend.writing(login):
+            yield
+
+    # Запись кэша пользователя (None — промах); на время работы с ней запись не вытесняется
+    @contextmanager
+    def _cached(self, login: str):
+        with self._lock:
+            entry = self._entries.get(login)
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(login)
+                self.hits += 1
+                entry.pins += 1
+        try:
+            yield entry
+        finally:
+            if entry is not None:
+                with self._lock:
+                    entry.pins -= 1
+                self._evict()
+
+    @contextmanager
+    def _write(self, login: str):
+        with self.backend.writing(login):
+            with self._cached(login) as entry:
+                yield entry
+
+    def _insert(self, login: str, entry: _Entry) -> None:
+        with self._lock:
+            self._entries[login] = entry
+            self.elements += entry.elements
+
+    def _drop(self, login: str, entry: _Entry) -> None:
+        with self._lock:
+            if self._entries.get(login) is entry:
+                del self._entries[login]
+                self.elements -= entry.elements
+                self.dirty_elements -= entry.dirty_elements
+
+    # Массивы незагруженной истории: первые persisted — из хранилища, остальные — из дозаписей
+    def _iter_appended(self, login: str, entry: _Entry, start: int, end: Union[int, None]) -> Iterator[List[int]]:
+        with self._lock:
+            persisted, appended = entry.persisted, list(entry.appended)
+        end = persisted + len(appended) if end is None else end
+        if start < persisted:
+            yield from self.backend.iter_all(login, start, min(end, persisted))
+        yield from appended[max(start - persisted, 0):max(end - persisted, 0)]
+
+    # Учёт изменения записи: размер кэша (delta) и объём несброшенных данных
+    def _changed(self, entry: _Entry, delta: int, dirty_elements: int = 0) -> None:
+        with self._lock:
+            entry.elements += delta
+            self.elements += delta
+            if self.mode == WRITE_BEHIND:
+                entry.dirty = True
+                entry.dirty_elements += dirty_elements
+                self.dirty_elements += dirty_elements
+                over_threshold = self.dirty_elements >= HISTORY_FLUSH_DIRTY_ELEMENTS
+        if self.mode == WRITE_BEHIND:
+            self._start_flusher()
+            if over_threshold:
+                self._flush_needed.set()
+
+    # Вытеснение давно не использованных записей. Несброшенные записи
+    # не вытесняются: их сначала запишет фоновый поток
+    def _evict(self) -> None:
+        with self._lock:
+            if self.elements <= self.max_elements:
+                return
+            for login in list(self._entries):
+                if self.elements <= self.max_elements:
+                    break
+                entry = self._entries[login]
+                if entry.pins or entry.dirty:
+                    continue
+                del self._entries[login]
+                self.elements -= entry.elements
+                self.evictions += 1
+            over_budget = self.elements > self.max_elements
+        if over_budget and self.mode == WRITE_BEHIND:
+            self._flush_needed.set()
+
+    def count(self, login: str) -> Union[int, None]:
+        with self._cached(login) as entry:
+            return self.backend.count(login) if entry is None else entry.count()
+
+    def append(self, login: str, array: List[int]) -> int:
+        return self.extend(login, [array])
+
+    def extend(self, login: str, arrays: List[List[int]]) -> int:
+        arrays = [list(array) for array in arrays]
+        size = _size(arrays)
+        with self._write(login) as entry:
+            if self.mode == WRITE_THROUGH:
+                position = self.backend.extend(login, arrays)
+                if entry is not None:
+                    entry.arrays.extend(arrays)
+                    self._changed(entry, size)
+                return position
+            if entry is None:
+                entry = _Entry(None, self.backend.count(login) or 0)
+                entry.dirty = True  # до _changed запись уже не должна вытесняться
+                self._insert(login, entry)
+            position = entry.count() or 0
+            if entry.arrays is None:
+                entry.appended.extend(arrays)
+            else:
+                entry.arrays.extend(arrays)
+                entry.missing = False
+            self._changed(entry, size, size)
+        return position
+
+    def read_range(self, login: str, start: int, end: int) -> List[List[int]]:
+        with self._cached(login) as entry:
+            if entry is None:
+                return self.backend.read_range(login, start, end)
+            if entry.arrays is not None:
+                return entry.arrays[start:end]
+            return list(self._iter_appended(login, entry, start, end))
+
+    # Снимок списка берётся под блокировкой, массивы в кэше не изменяются на месте
+    def iter_all(self, login: str, start: int = 0, end: Union[int, None] = None) -> Iterator[List[int]]:
+        with self._cached(login) as entry:
+            if entry is None:
+                arrays = self.backend.iter_all(login, start, end)
+            elif entry.arrays is not None:
+                arrays = entry.arrays[start:end]
+            else:
+                arrays = self._iter_appended(login, entry, start, end)
+        yield from arrays
+
+    # Полное чтение загружает историю в кэш, если она есть и помещается в бюджет
+    def read_all(self, login: str) -> List[List[int]]:
+        with self.backend.reading(login):
+            with self._cached(login) as entry:
+                if entry is not None and entry.arrays is not None:
+                    return list(entry.arrays)
+                if entry is not None:
+                    return list(self._iter_appended(login, entry, 0, None))
+            if self.backend.count(login) is None:
+                return []
+            arrays = self.backend.read_all(login)
+            entry = _Entry(arrays, len(arrays))
+            if entry.elements <= self.max_elements:
+                self._insert(login, entry)
+                self._evict()
+            return list(arrays)
+
+    # Без несброшенных изменений сводки берутся из хранилища; иначе несброшенная часть
+    # (вся загруженная история или дозаписи незагруженной) считается по массивам в кэше
+    def summaries(self, login: str) -> List[tuple]:
+        with self._cached(login) as entry:
+            if entry is None or not entry.dirty:
+                return self.backend.summaries(login)
+            if entry.missing:
+                return []
+            if entry.arrays is not None:
+                return [summarize_array(array) for array in entry.arrays]
+            with self._lock:
+                persisted, appended = entry.persisted, list(entry.appended)
+            return self.backend.summaries(login)[:persisted] + [summarize_array(array) for array in appended]
+
+    # Копия: обработчики изменяют полученный массив
+    def get(self, login: str, position: int) -> List[int]:
+        with self._cached(login) as entry:
+            if entry is None:
+                return self.backend.get(login, position)
+            if entry.arrays is not None:
+                return list(entry.arrays[position])
+            return next(self._iter_appended(login, entry, position, position + 1))
+
+    def replace(self, login: str, position: int, array: List[int]) -> None:
+        with self._write(login) as entry:
+            if entry is not None and entry.arrays is None:
+                self.flush(login)
+                entry = None
+            if entry is None or self.mode == WRITE_THROUGH:
+                self.backend.replace(login, position, array)
+                if entry is None:
+                    return
+            elif position < entry.persisted:
+                entry.replaced.add(position)
+            old = entry.arrays[position]
+            entry.arrays[position] = list(array)
+            self._changed(entry, len(array) - len(old), len(array) + 1)
+
+    def delete(self, login: str, position: int) -> List[int]:
+        with self._write(login) as entry:
+            if entry is not None and entry.arrays is None:
+                self.flush(login)
+                entry = None
+            if entry is None:
+                return self.backend.delete(login, position)
+            if self.mode == WRITE_THROUGH:
+                self.backend.delete(login, position)
+            # Удаление ещё не сброшенного массива не сдвигает позиции в хранилище
+            elif position < entry.persisted:
+                entry.rewrite = True
+            deleted = entry.arrays.pop(position)
+            self._changed(entry, -(len(deleted) + 1))
+        return deleted
+
+    # Удаление без отложенной записи, кроме загруженной истории в режиме write-behind:
+    # запись остаётся в кэше пустой до сброса и после него удаляется
+    def delete_all(self, login: str) -> bool:
+        with self._write(login) as entry:
+            if entry is None or entry.arrays is None or self.mode == WRITE_THROUGH:
+                existed = self.backend.delete_all(login)
+                if entry is not None:
+                    self._drop(login, entry)
+                    existed = True
+                return existed
+            existed = not entry.missing
+            entry.rewrite = True
+            entry.missing = True
+            entry.arrays = []
+            self._changed(entry, -entry.elements)
+        return existed
+
+    # Сброс несброшенных изменений пользователя в хранилище
+    @metrics.timed("history_flush")
+    def flush(self, login: str) -> None:
+        with self.backend.writing(login):
+            with self._lock:
+                entry = self._entries.get(login)
+            if entry is None or not entry.dirty:
+                return
+            arrays = entry.arrays or []
+            if entry.arrays is None:
+                self.backend.extend(login, entry.appended)
+            elif entry.rewrite:
+                if arrays:
+                    self.backend.rewrite(login, arrays)
+                else:
+                    self.backend.delete_all(login)
+            else:
+                for position in sorted(entry.replaced):
+                    self.backend.replace(login, position, arrays[position])
+                if len(arrays) > entry.persisted:
+                    self.backend.extend(login, arrays[entry.persisted:])
+            with self._lock:
+                entry.dirty = False
+                if entry.arrays is None:
+                    entry.persisted += len(entry.appended)
+                    entry.appended = []
+                else:
+                    entry.persisted = len(arrays)
+                entry.replaced = set()
+                entry.rewrite = False
+                self.dirty_elements -= entry.dirty_elements
+                entry.dirty_elements = 0
+                self.flushes += 1
+            # Сброшенные дозаписи и удалённая история в кэше не нужны
+            if entry.arrays is None or entry.missing:
+                self._drop(login, entry)
+
+    def flush_all(self) -> None:
+        with self._lock:
+            dirty = [login for login, entry in self._entries.items() if entry.dirty]
+        for login in dirty:
+            try:
+                self.flush(login)
+            except Exception as e:  # изменения остаются в кэше до следующей попытки
+                print(f"History flush failed for {login}: {e}")
+        self._evict()
+
+    def _start_flusher(self) -> None:
+        with self._lock:
+            if self._flusher is not None or self._stopped:
+                return
+            self._flusher = threading.Thread(target=self._run_flusher, daemon=True)
+        self._flusher.start()
+
+    def _run_flusher(self) -> None:
+        while not self._stopped:
+            self._flush_needed.wait(HISTORY_FLUSH_INTERVAL)
+            self._flush_needed.clear()
+            self.flush_all()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "elements": self.elements,
+                "max_elements": self.max_elements,
+                "dirty_entries": sum(1 for entry in self._entries.values() if entry.dirty),
+                "dirty_elements": self.dirty_elements,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "flushes": self.flushes,
+            }
+
+    # Остановка: фоновый поток завершается, оставшиеся изменения сбрасываются
+    def shutdown(self) -> None:
+        self._stopped = True
+        self._flush_needed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush_all()
+        self.backend.shutdown()
@@ -0,0 +1,93 @@
+from itertools import accumulate
+from typing import List, Tuple, Union
+import json
+import os
+import struct
+import zlib
+from packed import pack_array, unpack_array
+
+try:
+    import zstandard
+except ImportError:  # zstandard необязателен: без него используется zlib
+    zstandard = None
+
+# Сжатие записей истории: "zlib" (по умолчанию), "zstd" (если установлен zstandard) или "none"
+HISTORY_COMPRESSION = os.environ.get("HISTORY_COMPRESSION", "zlib")
+HISTORY_COMPRESSION_LEVEL = int(os.environ.get("HISTORY_COMPRESSION_LEVEL", "6"))
+# Массивы короче сжимать невыгодно: заголовок сжатых данных больше выигрыша
+HISTORY_COMPRESS_MIN_SIZE = int(os.environ.get("HISTORY_COMPRESS_MIN_SIZE", "16"))
+
+# Первый байт записи задаёт формат; несжатая запись — обычный JSON (начинается с '[')
+DELTA_ZLIB = b'\x01'   # разности соседних элементов, int64 little-endian, zlib
+JSON_ZLIB = b'\x02'    # JSON, zlib (значения не помещаются в int64)
+DELTA_ZSTD = b'\x03'
+JSON_ZSTD = b'\x04'
+
+# Сводка массива для статистики (history_stats): длина, минимум, максимум, сумма.
+# Хранилища ведут её рядом с массивом, чтобы статистика не читала саму историю.
+# В файловом хранилище — запись фиксированной длины: флаги, длина, минимум и максимум (int64),
+# сумма (int128). Сводка массива со значениями вне int64 не хранится (флаг SUMMARY_WIDE).
+SUMMARY_ROW = struct.Struct('<Bqqq16s')
+SUMMARY_EMPTY = 1
+SUMMARY_WIDE = 2
+
+Summary = Tuple[int, Union[int, None], Union[int, None], int]
+
+
+def _compress(data: bytes, zstd: bool) -> bytes:
+    if zstd:
+        return zstandard.ZstdCompressor(level=HISTORY_COMPRESSION_LEVEL).compress(data)
+    return zlib.compress(data, HISTORY_COMPRESSION_LEVEL)
+
+
+# Кодирование массива для хранения. У отсортированного массива разности соседних
+# элементов малы и неотрицательны, поэтому после них сжатие в разы сильнее, чем у JSON.
+def encode_array(array: List[int]) -> bytes:
+    if HISTORY_COMPRESSION == "none" or len(array) < HISTORY_COMPRESS_MIN_SIZE:
+        return json.dumps(array).encode()
+    zstd = HISTORY_COMPRESSION == "zstd" and zstandard is not None
+    try:
+        deltas = pack_array([array[0]] + [b - a for a, b in zip(array, array[1:])])
+    except OverflowError:
+        return (JSON_ZSTD if zstd else JSON_ZLIB) + _compress(json.dumps(array).encode(), zstd)
+    return (DELTA_ZSTD if zstd else DELTA_ZLIB) + _compress(deltas, zstd)
+
+
+def summarize_array(array: List[int]) -> Summary:
+    if not array:
+        return 0, None, None, 0
+    return len(array), min(array), max(array), sum(array)
+
+
+def pack_summary(array: List[int]) -> bytes:
+    length, low, high, total = summarize_array(array)
+    if not length:
+        return SUMMARY_ROW.pack(SUMMARY_EMPTY, 0, 0, 0, bytes(16))
+    if low < -(2 ** 63) or high >= 2 ** 63:
+        return SUMMARY_ROW.pack(SUMMARY_WIDE, length, 0, 0, bytes(16))
+    return SUMMARY_ROW.pack(0, length, low, high, total.to_bytes(16, 'little', signed=True))
+
+
+# Сводка из полей записи SUMMARY_ROW; None — сводка не хранится (SUMMARY_WIDE)
+def unpack_summary(fields: tuple) -> Union[Summary, None]:
+    flags, length, low, high, total = fields
+    if flags & SUMMARY_WIDE:
+        return None
+    if flags & SUMMARY_EMPTY:
+        return 0, None, None, 0
+    return length, low, high, int.from_bytes(total, 'little', signed=True)
+
+
+def decode_array(data: bytes) -> List[int]:
+    marker = data[:1]
+    if marker in (DELTA_ZSTD, JSON_ZSTD):
+        if zstandard is None:
+            raise RuntimeError("History record is zstd-compressed, but zstandard is not installed")
+        payload = zstandard.ZstdDecompressor().decompress(data[1:])
+    elif marker in (DELTA_ZLIB, JSON_ZLIB):
+        payload = zlib.decompress(data[1:])
+    else:
+        return json.loads(data)
+    if marker in (DELTA_ZLIB, DELTA_ZSTD):
+        return list(accumulate(unpack_array(payload)))
+    return json.loads(payload)
@@ -0,0 +1,168 @@
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Set, Union
+import os
+import threading
+from sort_engine import is_sorted
+
+# Для скольких пользователей держать индексы поиска (вытесняются давно не запрошенные)
+HISTORY_SEARCH_MAX_USERS = int(os.environ.get("HISTORY_SEARCH_MAX_USERS", "1000"))
+# Инвертированный индекс "значение -> массивы" (HISTORY_SEARCH_INDEX=1); без него
+# поиск значения проходит по всем массивам истории
+HISTORY_SEARCH_INDEX = os.environ.get("HISTORY_SEARCH_INDEX") == "1"
+
+
+# Индекс пользователя. У массива постоянный id (позиции сдвигаются при удалении):
+# ids — id массивов в порядке истории, ordered — отсортирован ли массив,
+# postings — значение -> id массивов, где оно встречается.
+class _UserIndex:
+    def __init__(self, with_postings: bool):
+        self.ids: List[int] = []
+        self.ordered: List[bool] = []
+        self.postings: Union[Dict[int, Set[int]], None] = {} if with_postings else None
+        self.next_id = 0
+        self.version = 0  # версия истории (HistoryVersions), по которой построен индекс
+        self._positions: Union[Dict[int, int], None] = None
+
+    def insert(self, position: int, array: List[int]):
+        array_id = self.next_id
+        self.next_id += 1
+        self.ids.insert(position, array_id)
+        self.ordered.insert(position, is_sorted(array))
+        self._add_postings(array_id, array)
+        self._positions = None
+
+    def add_values(self, position: int, array: List[int], values: Iterable[int]):
+        self.ordered[position] = is_sorted(array)
+        self._add_postings(self.ids[position], values)
+
+    def pop(self, position: int, array: List[int]):
+        array_id = self.ids.pop(position)
+        self.ordered.pop(position)
+        if self.postings is not None:
+            for value in set(array):
+                ids = self.postings.get(value)
+                if ids is not None:
+                    ids.discard(array_id)
+                    if not ids:
+                        del self.postings[value]
+        self._positions = None
+
+    def _add_postings(self, array_id: int, values: Iterable[int]):
+        if self.postings is not None:
+            for value in set(values):
+                self.postings.setdefault(value, set()).add(array_id)
+
+    # Позиции массивов, содержащих значение (по индексу)
+    def positions_of(self, value: int) -> List[int]:
+        if self._positions is None:
+            self._positions = {array_id: position for position, array_id in enumerate(self.ids)}
+        return sorted(self._positions[array_id] for array_id in self.postings.get(value, ()))
+
+
+# Элементы из [low, high] в массиве (None — их нет). В отсортированном массиве они идут
+# подряд: границы {"start", "end"} (end не включается) находятся бинарным поиском;
+# в остальных — список позиций {"positions"}.
+def _match(array: List[int], ordered: bool, low: Union[int, None], high: Union[int, None]) -> Union[dict, None]:
+    if ordered:
+        start = 0 if low is None else bisect_left(array, low)
+        end = len(array) if high is None else bisect_right(array, high)
+        return {"start": start, "end": end} if start < end else None
+    positions = [i for i, value in enumerate(array)
+                 if (low is None or value >= low) and (high is None or value <= high)]
+    return {"positions": positions} if positions else None
+
+
+# Поиск значения или диапазона значений по истории пользователя.
+# Индекс строится при первом поиске одним проходом по истории, дальше обработчики
+# обновляют его под блокировкой записи пользователя (как и HistoryStats). Индекс привязан
+# к версии истории: после изменений другого воркера он строится заново.
+class HistorySearch:
+    def __init__(self, history, versions, with_postings: bool = HISTORY_SEARCH_INDEX,
+                 max_users: int = HISTORY_SEARCH_MAX_USERS):
+        self.history = history
+        self.versions = versions
+        self.with_postings = with_postings
+        self.max_users = max_users
+        self._indexes: "OrderedDict[str, _UserIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _rebuild(self, login: str, version: int) -> _UserIndex:
+        index = _UserIndex(self.with_postings)
+        index.version = version
+        for array in self.history.iter_all(login):
+            index.insert(len(index.ids), array)
+        with self._lock:
+            self._indexes[login] = index
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    # Индекс, к которому применяется изменение, переводящее историю в версию version
+    # (только если он построен по версии version - 1, иначе он отбрасывается)
+    def _loaded(self, login: str, version: int) -> Union[_UserIndex, None]:
+        with self._lock:
+            index = self._indexes.get(login)
+            if index is None:
+                return None
+            if index.version != version - 1:
+                del self._indexes[login]
+                return None
+            index.version = version
+            return index
+
+    # Обновления применяются, только если индекс пользователя уже построен
+    def append(self, login: str, arrays: List[List[int]], version: int):
+        index = self._loaded(login, version)
+        if index is not None:
+            for array in arrays:
+                index.insert(len(index.ids), array)
+
+    # В массив на позиции position добавлены значения values (array — массив после вставки)
+    def add_values(self, login: str, position: int, array: List[int], values: List[int], version: int):
+        index = self._loaded(login, version)
+        if index is not None:
+            index.add_values(position, array, values)
+
+    def delete(self, login: str, position: int, array: List[int], version: int):
+        index = self._loaded(login, version)
+        if index is not None:
+            index.pop(position, array)
+
+    def discard(self, login: str):
+        with self._lock:
+            self._indexes.pop(login, None)
+
+    # Совпадения [{"index": позиция массива, "start": ..., "end": ...}] для отсортированных массивов
+    # и [{"index": ..., "positions": [позиции элементов]}] для остальных,
+    # или None, если истории нет. low/high — границы диапазона включительно.
+    def search(self, login: str, low: Union[int, None], high: Union[int, None]) -> Union[List[dict], None]:
+        with self.history.reading(login):
+            count = self.history.count(login)
+            if not count:
+                return None
+            version = self.versions.get(login)
+            with self._lock:
+                index = self._indexes.get(login)
+                if index is not None:
+                    self._indexes.move_to_end(login)
+            if index is None or index.version != version:
+                index = self._rebuild(login, version)
+
+            # Точное значение при включённом индексе — только массивы, где оно есть
+            if low is not None and low == high and index.postings is not None:
+                candidates = ((position, self.history.get(login, position))
+                              for position in index.positions_of(low))
+            else:
+                candidates = enumerate(self.history.iter_all(login))
+
+            matches = []
+            for position, array in candidates:
+                match = _match(array, index.ordered[position], low, high)
+                if match is not None:
+                    matches.append({"index": position, **match})
+        return matches
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"users": len(self._indexes), "max_users": self.max_users}
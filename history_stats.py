@@ -0,0 +1,167 @@
+from collections import OrderedDict
+from typing import Dict, List, Union
+import os
+import threading
+from history_codec import summarize_array
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: без него сводка и агрегаты считаются на чистом Python
+    np = None
+
+# Для скольких пользователей держать сводки (вытесняются давно не запрошенные)
+HISTORY_STATS_MAX_USERS = int(os.environ.get("HISTORY_STATS_MAX_USERS", "10000"))
+
+PERCENTILES = (50, 90, 99)
+
+
+# Сводка по истории пользователя: по одной строке на массив
+# (длина, минимум, максимум, сумма) в порядке истории
+class _Summary:
+    def __init__(self):
+        self.lengths: List[int] = []
+        self.mins: List[int] = []
+        self.maxs: List[int] = []
+        self.sums: List[int] = []
+        self.version = 0  # версия истории (HistoryVersions), по которой построена сводка
+
+    def insert(self, position: int, array: List[int]):
+        self.insert_row(position, summarize_array(array))
+
+    def insert_row(self, position: int, row: tuple):
+        length, low, high, total = row
+        self.lengths.insert(position, length)
+        self.mins.insert(position, low)
+        self.maxs.insert(position, high)
+        self.sums.insert(position, total)
+
+    def pop(self, position: int):
+        for column in (self.lengths, self.mins, self.maxs, self.sums):
+            column.pop(position)
+
+
+# Процентиль с линейной интерполяцией (как np.percentile) по отсортированному списку
+def _percentile(values: List[int], p: float) -> float:
+    rank = (len(values) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+# Агрегаты по длинам массивов: NumPy, если доступен, иначе чистый Python
+def _length_stats(lengths: List[int]) -> dict:
+    if np is not None:
+        column = np.array(lengths, dtype=np.int64)
+        percentiles = np.percentile(column, PERCENTILES)
+        low, high, mean = int(column.min()), int(column.max()), float(column.mean())
+    else:
+        ordered = sorted(lengths)
+        percentiles = [_percentile(ordered, p) for p in PERCENTILES]
+        low, high, mean = ordered[0], ordered[-1], sum(ordered) / len(ordered)
+    return {
+        "min": low,
+        "max": high,
+        "mean": mean,
+        **{f"p{p}": float(value) for p, value in zip(PERCENTILES, percentiles)},
+    }
+
+
+# Статистика истории сортировок, обновляемая при каждом изменении истории.
+# Строки сводки (по массиву) хранилище истории ведёт само рядом с историей (summaries),
+# здесь держится только их кэш в памяти процесса: он загружается из хранилища при первом
+# запросе, дальше обработчики обновляют его по изменённым массивам. Чтение статистики считает
+# агрегаты по сводке (векторно через NumPy, если он установлен) и саму историю не читает.
+# Изменения передаются под блокировкой записи пользователя в истории вместе с новой версией.
+# Кэш привязан к версии истории: если историю изменил другой воркер, версия
+# не совпадёт, и сводка будет заново прочитана из хранилища.
+class HistoryStats:
+    def __init__(self, history, versions, max_users: int = HISTORY_STATS_MAX_USERS):
+        self.history = history
+        self.versions = versions
+        self.max_users = max_users
+        self._summaries: "OrderedDict[str, _Summary]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Загрузка сводки из хранилища истории
+    def _rebuild(self, login: str, version: int) -> _Summary:
+        summary = _Summary()
+        summary.version = version
+        for row in self.history.summaries(login):
+            summary.insert_row(len(summary.lengths), row)
+        with self._lock:
+            self._summaries[login] = summary
+            while len(self._summaries) > self.max_users:
+                self._summaries.popitem(last=False)
+        return summary
+
+    # Сводка, к которой применяется изменение, переводящее историю в версию version.
+    # Применяется, только если сводка построена по предыдущей версии (version - 1);
+    # иначе между ними были чужие изменения, и сводка отбрасывается.
+    def _loaded(self, login: str, version: int) -> Union[_Summary, None]:
+        with self._lock:
+            summary = self._summaries.get(login)
+            if summary is None:
+                return None
+            if summary.version != version - 1:
+                del self._summaries[login]
+                return None
+            summary.version = version
+            return summary
+
+    # Обновления применяются, только если сводка пользователя уже построена
+    def append(self, login: str, arrays: List[List[int]], version: int):
+        summary = self._loaded(login, version)
+        if summary is not None:
+            for array in arrays:
+                summary.insert(len(summary.lengths), array)
+
+    def replace(self, login: str, position: int, array: List[int], version: int):
+        summary = self._loaded(login, version)
+        if summary is not None:
+            summary.pop(position)
+            summary.insert(position, array)
+
+    def delete(self, login: str, position: int, version: int):
+        summary = self._loaded(login, version)
+        if summary is not None:
+            summary.pop(position)
+
+    def discard(self, login: str):
+        with self._lock:
+            self._summaries.pop(login, None)
+
+    # Статистика или None, если истории нет. Если сводка в кэше построена по другой версии
+    # истории (её изменил другой процесс), она заново читается из хранилища.
+    def get(self, login: str) -> Union[dict, None]:
+        with self.history.reading(login):
+            count = self.history.count(login)
+            if not count:
+                return None
+            version = self.versions.get(login)
+            with self._lock:
+                summary = self._summaries.get(login)
+                if summary is not None:
+                    self._summaries.move_to_end(login)
+            if summary is None or summary.version != version:
+                summary = self._rebuild(login, version)
+            lengths = list(summary.lengths)
+            # Минимумы, максимумы и суммы могут не помещаться в int64 — считаются целыми Python
+            mins = [value for value in summary.mins if value is not None]
+            maxs = [value for value in summary.maxs if value is not None]
+            total = sum(summary.sums)
+
+        elements = sum(lengths)
+        return {
+            "arrays": count,
+            "elements": elements,
+            "length": _length_stats(lengths),
+            "value": {
+                "min": min(mins) if mins else None,
+                "max": max(maxs) if maxs else None,
+                "mean": total / elements if elements else None,
+            },
+        }
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"users": len(self._summaries), "max_users": self.max_users}
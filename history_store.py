@@ -0,0 +1,345 @@
+from typing import List, Union, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import os
+import struct
+import threading
+from storage import load_json, shard, HistoryBackend
+from history_codec import encode_array, decode_array, pack_summary, unpack_summary, summarize_array, SUMMARY_ROW
+from lock_manager import LockManager
+from metrics import metrics
+
+# Запись индекса: смещение и длина записи в журнале (little-endian uint64)
+INDEX_ENTRY = struct.Struct('<QQ')
+
+# Компактировать журнал, когда мусор (удалённые и перезаписанные записи)
+# занимает больше этой доли файла и больше минимального размера
+COMPACT_GARBAGE_RATIO = 0.5
+COMPACT_MIN_BYTES = 64 * 1024
+
+
+# История сортировок пользователя в виде журнала только на дозапись:
+#   history/{shard}/{login}_history.log — по записи на массив (JSON-строка или сжатый массив, см. history_codec);
+#   history/{shard}/{login}_history.idx — смещения живых записей в порядке истории;
+#   history/{shard}/{login}_history.stats — сводки массивов для статистики в том же порядке
+# ({shard} — префикс хеша логина, см. storage.shard).
+# Файл сводок меняется вместе с индексом. Если его нет или число записей в нём не совпадает
+# с индексом (история до появления сводок, сбой между записями), он строится заново при чтении.
+# Добавление пишет одну запись, чтение среза читает только нужные записи,
+# удаление и изменение работают через индекс, а мусор убирает фоновая компакция.
+# Каждая операция берёт блокировку чтения или записи пользователя из LockManager.
+class HistoryStore(HistoryBackend):
+    def __init__(self, folder_path: str = 'history/', locks: Union[LockManager, None] = None):
+        self.folder_path = folder_path
+        self.locks = locks or LockManager(os.path.join(folder_path, '.locks'))
+        self._compactor = ThreadPoolExecutor(max_workers=1)
+
+    def _shard_path(self, login: str) -> str:
+        return os.path.join(self.folder_path, shard(login))
+
+    def _log_path(self, login: str) -> str:
+        return os.path.join(self._shard_path(login), f"{login}_history.log")
+
+    def _index_path(self, login: str) -> str:
+        return os.path.join(self._shard_path(login), f"{login}_history.idx")
+
+    def _summary_path(self, login: str) -> str:
+        return os.path.join(self._shard_path(login), f"{login}_history.stats")
+
+    # Старые {login}_history.json: в корне history/ (до разбиения на подкаталоги)
+    # и в подкаталоге (перенесённые migrate_layout.py)
+    def _legacy_paths(self, login: str) -> List[str]:
+        return [os.path.join(self.folder_path, f"{login}_history.json"),
+                os.path.join(self._shard_path(login), f"{login}_history.json")]
+
+    # Перенос старого {login}_history.json в формат журнала. Если журнал уже есть
+    # (пользователь сортировал до переноса файла), старые массивы ставятся перед ним.
+    def _migrate_legacy(self, login: str):
+        if not any(os.path.exists(path) for path in self._legacy_paths(login)):
+            return
+        with self.locks.write(login):
+            legacy_paths = [path for path in self._legacy_paths(login) if os.path.exists(path)]
+            if not legacy_paths:
+                return
+            history = []
+            for path in legacy_paths:
+                history.extend(load_json(path) or [])
+            history.extend(self._read_records(login, self._read_index(login)))
+            self._write_all(login, history)
+            for path in legacy_paths:
+                os.remove(path)
+
+    def _write_all(self, login: str, arrays) -> None:
+        os.makedirs(self._shard_path(login), exist_ok=True)
+        log_tmp = self._log_path(login) + '.tmp'
+        index_tmp = self._index_path(login) + '.tmp'
+        summary_tmp = self._summary_path(login) + '.tmp'
+        offset = 0
+        with open(log_tmp, 'wb') as log, open(index_tmp, 'wb') as index, open(summary_tmp, 'wb') as summary:
+            for array in arrays:
+                record = self._encode(array)
+                log.write(record)
+                index.write(INDEX_ENTRY.pack(offset, len(record)))
+                summary.write(pack_summary(array))
+                offset += len(record)
+        self._drop_summaries(login)  # старые сводки не должны остаться при новом индексе после сбоя
+        os.replace(log_tmp, self._log_path(login))
+        os.replace(index_tmp, self._index_path(login))
+        os.replace(summary_tmp, self._summary_path(login))
+
+    # Несжатые записи остаются JSON-строками, сжатые пишутся как есть (читаются по индексу)
+    @staticmethod
+    def _encode(array: List[int]) -> bytes:
+        record = encode_array(array)
+        return record + b'\n' if record[:1] == b'[' else record
+
+    def _read_index(self, login: str, start: int = 0, end: Union[int, None] = None):
+        try:
+            with open(self._index_path(login), 'rb') as f:
+                f.seek(start * INDEX_ENTRY.size)
+                size = -1 if end is None else (end - start) * INDEX_ENTRY.size
+                data = f.read(size)
+        except FileNotFoundError:
+            return []
+        return list(INDEX_ENTRY.iter_unpack(data))
+
+    def _write_index(self, login: str, entries) -> None:
+        index_tmp = self._index_path(login) + '.tmp'
+        with open(index_tmp, 'wb') as f:
+            f.write(b''.join(INDEX_ENTRY.pack(*entry) for entry in entries))
+        os.replace(index_tmp, self._index_path(login))
+
+    def _read_records(self, login: str, entries) -> Iterator[List[int]]:
+        if not entries:
+            return
+        with open(self._log_path(login), 'rb') as log:
+            for offset, length in entries:
+                log.seek(offset)
+                yield decode_array(log.read(length))
+
+    # Сводки ведутся, только пока файл сводок соответствует индексу из count записей;
+    # иначе файл удаляется и будет построен заново при чтении
+    def _summaries_match(self, login: str, count: int) -> bool:
+        try:
+            return os.path.getsize(self._summary_path(login)) == count * SUMMARY_ROW.size
+        except FileNotFoundError:
+            return False
+
+    def _drop_summaries(self, login: str) -> None:
+        try:
+            os.remove(self._summary_path(login))
+        except FileNotFoundError:
+            pass
+
+    # Вызывается до записи в индекс: сбой между ними даёт несовпадение числа записей
+    def _append_summaries(self, login: str, count: int, arrays: List[List[int]]) -> None:
+        if self._summaries_match(login, count):
+            with open(self._summary_path(login), 'ab') as f:
+                f.write(b''.join(pack_summary(array) for array in arrays))
+        else:
+            self._drop_summaries(login)
+
+    def _append_record(self, login: str, array: List[int]):
+        os.makedirs(self._shard_path(login), exist_ok=True)
+        record = self._encode(array)
+        with open(self._log_path(login), 'ab') as log:
+            offset = log.tell()
+            log.write(record)
+        return offset, len(record)
+
+    # Блокировки для последовательностей операций (прочитать-изменить-записать) в обработчиках
+    @contextmanager
+    def reading(self, login: str):
+        self._migrate_legacy(login)
+        with self.locks.read(login):
+            yield
+
+    @contextmanager
+    def writing(self, login: str):
+        self._migrate_legacy(login)
+        with self.locks.write(login):
+            yield
+
+    # Количество массивов в истории (None, если истории нет)
+    @metrics.timed("history_read")
+    def count(self, login: str) -> Union[int, None]:
+        self._migrate_legacy(login)
+        try:
+            return os.path.getsize(self._index_path(login)) // INDEX_ENTRY.size
+        except FileNotFoundError:
+            return None
+
+    @metrics.timed("history_write")
+    def append(self, login: str, array: List[int]) -> int:
+        self._migrate_legacy(login)
+        with self.locks.write(login):
+            entry = self._append_record(login, array)
+            with open(self._index_path(login), 'ab') as index:
+                position = index.tell() // INDEX_ENTRY.size
+                self._append_summaries(login, position, [array])
+                index.write(INDEX_ENTRY.pack(*entry))
+        return position
+
+    # Добавление нескольких массивов одной записью в журнал и одной в индекс
+    @metrics.timed("history_write")
+    def extend(self, login: str, arrays: List[List[int]]) -> int:
+        self._migrate_legacy(login)
+        os.makedirs(self._shard_path(login), exist_ok=True)
+        records = [self._encode(array) for array in arrays]
+        with self.locks.write(login):
+            with open(self._log_path(login), 'ab') as log:
+                offset = log.tell()
+                log.write(b''.join(records))
+            entries = []
+            for record in records:
+                entries.append(INDEX_ENTRY.pack(offset, len(record)))
+                offset += len(record)
+            with open(self._index_path(login), 'ab') as index:
+                position = index.tell() // INDEX_ENTRY.size
+                self._append_summaries(login, position, arrays)
+                index.write(b''.join(entries))
+        return position
+
+    @metrics.timed("history_read")
+    def read_range(self, login: str, start: int, end: int) -> List[List[int]]:
+        self._migrate_legacy(login)
+        with self.locks.read(login):
+            return list(self._read_records(login, self._read_index(login, start, end)))
+
+    # Ленивое чтение истории для потоковой отдачи. Под блокировкой берутся только
+    # снимок индекса и открытый файл журнала: компакция заменяет файл целиком,
+    # поэтому уже открытый дескриптор продолжает указывать на согласованные данные.
+    def iter_all(self, login: str, start: int = 0, end: Union[int, None] = None) -> Iterator[List[int]]:
+        self._migrate_legacy(login)
+        with self.locks.read(login):
+            entries = self._read_index(login, start, end)
+            if not entries:
+                return
+            log = open(self._log_path(login), 'rb')
+        with log:
+            for offset, length in entries:
+                log.seek(offset)
+                yield decode_array(log.read(length))
+
+    @metrics.timed("history_read")
+    def read_all(self, login: str) -> List[List[int]]:
+        return list(self.iter_all(login))
+
+    # Сводки читаются из файла сводок; из журнала читаются только массивы со значениями
+    # вне int64 и, один раз, история без файла сводок. Восстановление файла под блокировкой
+    # чтения безопасно: писатели исключены, а читатели пишут одинаковое содержимое.
+    @metrics.timed("history_read")
+    def summaries(self, login: str) -> List[tuple]:
+        self._migrate_legacy(login)
+        with self.locks.read(login):
+            entries = self._read_index(login)
+            if not entries:
+                return []
+            data = None
+            if self._summaries_match(login, len(entries)):
+                with open(self._summary_path(login), 'rb') as f:
+                    data = f.read()
+            if data is None or len(data) != len(entries) * SUMMARY_ROW.size:
+                data = b''.join(pack_summary(array) for array in self._read_records(login, entries))
+                summary_tmp = f"{self._summary_path(login)}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(summary_tmp, 'wb') as f:
+                    f.write(data)
+                os.replace(summary_tmp, self._summary_path(login))
+            summaries = []
+            for entry, fields in zip(entries, SUMMARY_ROW.iter_unpack(data)):
+                summary = unpack_summary(fields)
+                if summary is None:
+                    summary = summarize_array(next(self._read_records(login, [entry])))
+                summaries.append(summary)
+            return summaries
+
+    # Перезапись массива: новая версия дописывается в журнал, индекс указывает на неё
+    @metrics.timed("history_write")
+    def replace(self, login: str, position: int, array: List[int]) -> None:
+        with self.locks.write(login):
+            entry = self._append_record(login, array)
+            with open(self._index_path(login), 'r+b') as index:
+                if self._summaries_match(login, os.fstat(index.fileno()).st_size // INDEX_ENTRY.size):
+                    with open(self._summary_path(login), 'r+b') as summary:
+                        summary.seek(position * SUMMARY_ROW.size)
+                        summary.write(pack_summary(array))
+                else:
+                    self._drop_summaries(login)
+                index.seek(position * INDEX_ENTRY.size)
+                index.write(INDEX_ENTRY.pack(*entry))
+        self._maybe_compact(login)
+
+    # Удаление массива: запись остаётся в журнале, пропадает только из индекса
+    @metrics.timed("history_write")
+    def delete(self, login: str, position: int) -> List[int]:
+        with self.locks.write(login):
+            entries = self._read_index(login)
+            deleted = entries.pop(position)
+            deleted_array = next(self._read_records(login, [deleted]))
+            if self._summaries_match(login, len(entries) + 1):
+                with open(self._summary_path(login), 'rb') as f:
+                    data = f.read()
+                summary_tmp = self._summary_path(login) + '.tmp'
+                with open(summary_tmp, 'wb') as f:
+                    f.write(data[:position * SUMMARY_ROW.size] + data[(position + 1) * SUMMARY_ROW.size:])
+                self._drop_summaries(login)
+                self._write_index(login, entries)
+                os.replace(summary_tmp, self._summary_path(login))
+            else:
+                self._drop_summaries(login)
+                self._write_index(login, entries)
+        self._maybe_compact(login)
+        return deleted_array
+
+    @metrics.timed("history_write")
+    def delete_all(self, login: str) -> bool:
+        with self.locks.write(login):
+            existed = False
+            self._drop_summaries(login)
+            for path in (self._log_path(login), self._index_path(login), *self._legacy_paths(login)):
+                if os.path.exists(path):
+                    os.remove(path)
+                    existed = True
+            return existed
+
+    # Журнал и индекс пишутся заново во временные файлы и подменяются
+    @metrics.timed("history_write")
+    def rewrite(self, login: str, arrays: List[List[int]]) -> None:
+        self._migrate_legacy(login)
+        with self.locks.write(login):
+            self._write_all(login, arrays)
+
+    def _maybe_compact(self, login: str) -> None:
+        try:
+            total = os.path.getsize(self._log_path(login))
+        except FileNotFoundError:
+            return
+        live = sum(length for _, length in self._read_index(login))
+        garbage = total - live
+        if garbage >= COMPACT_MIN_BYTES and garbage > total * COMPACT_GARBAGE_RATIO:
+            self._compactor.submit(self.compact, login)
+
+    # Перезапись журнала только с живыми записями
+    @metrics.timed("history_compact")
+    def compact(self, login: str) -> None:
+        with self.locks.write(login):
+            entries = self._read_index(login)
+            if not os.path.exists(self._log_path(login)):
+                return
+            log_tmp = self._log_path(login) + '.tmp'
+            new_entries = []
+            offset = 0
+            with open(self._log_path(login), 'rb') as log, open(log_tmp, 'wb') as out:
+                for old_offset, length in entries:
+                    log.seek(old_offset)
+                    out.write(log.read(length))
+                    new_entries.append((offset, length))
+                    offset += length
+            index_tmp = self._index_path(login) + '.tmp'
+            with open(index_tmp, 'wb') as f:
+                f.write(b''.join(INDEX_ENTRY.pack(*entry) for entry in new_entries))
+            os.replace(log_tmp, self._log_path(login))
+            os.replace(index_tmp, self._index_path(login))
+
+    def shutdown(self) -> None:
+        self._compactor.shutdown(wait=True)
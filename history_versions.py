@@ -0,0 +1,33 @@
+import os
+import time
+from storage import shard
+
+
+# Версии историй пользователей для ETag: счётчик в файле {folder}/{shard}/{login}.ver,
+# который увеличивают все изменяющие историю обработчики (под блокировкой записи пользователя).
+# Файлы общие для воркеров uvicorn, поэтому версия одна на все процессы.
+# Новый счётчик начинается с time.time_ns(): после потери файлов версии не повторяют старые.
+class HistoryVersions:
+    def __init__(self, folder_path: str = 'history/.versions'):
+        self.folder_path = folder_path
+
+    def _path(self, login: str) -> str:
+        return os.path.join(self.folder_path, shard(login), f"{login}.ver")
+
+    def get(self, login: str) -> int:
+        try:
+            with open(self._path(login), 'rb') as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def bump(self, login: str) -> int:
+        version = self.get(login)
+        version = version + 1 if version else time.time_ns()
+        path = self._path(login)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(str(version).encode())
+        os.replace(tmp_path, path)  # читатели видят либо старую, либо новую версию
+        return version
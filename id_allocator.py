@@ -0,0 +1,37 @@
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: счётчик защищён только внутри одного процесса
+    fcntl = None
+
+
+# Выдача id пользователей: счётчик в файле, который увеличивается под flock,
+# поэтому id уникальны и возрастают и между воркерами uvicorn.
+# Новый счётчик начинается с текущего времени в секундах: прежние id были int(time.time())
+# и оказываются меньше всех новых.
+class IdAllocator:
+    def __init__(self, path: str = 'users/_next_id'):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        with self._lock:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                data = os.read(fd, 64).strip()
+                new_id = int(data) + 1 if data else int(time.time())
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, str(new_id).encode())
+                os.fsync(fd)  # id не должен повториться и после сбоя
+                return new_id
+            finally:
+                os.close(fd)  # закрытие снимает flock
@@ -0,0 +1,180 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from client import ApiClient
+
+# Набор операций по умолчанию: имя -> вес в смеси нагрузки
+DEFAULT_MIX = "sort=5,history=2,slice=2,patch=1,delete=1"
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for part in mix.split(','):
+        name, weight = part.split('=')
+        weights[name.strip()] = int(weight)
+    unknown = set(weights) - set(OPERATIONS)
+    if unknown:
+        raise ValueError(f"Unknown operations: {', '.join(sorted(unknown))}")
+    return weights
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+# Сбор задержек по эндпоинтам из всех виртуальных пользователей
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def call(self, name: str, api: ApiClient, method: str, path: str, data=None, params=None):
+        started = time.perf_counter()
+        try:
+            response = api.request(method, path, data=data, params=params)
+            ok = response.status_code < 500
+        except Exception:
+            response, ok = None, False
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.latencies.setdefault(name, []).append(elapsed_ms)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+        return response
+
+    def report(self, duration: float) -> dict:
+        endpoints = {}
+        total = 0
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            total += len(values)
+            endpoints[name] = {
+                "count": len(values),
+                "errors": self.errors.get(name, 0),
+                "p50_ms": percentile(values, 50),
+                "p95_ms": percentile(values, 95),
+                "p99_ms": percentile(values, 99),
+                "max_ms": values[-1],
+            }
+        return {
+            "duration_s": duration,
+            "requests": total,
+            "throughput_rps": total / duration if duration else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+# Операции виртуального пользователя
+def op_sort(rec, api, login, args):
+    arrays = [[random.randint(-10 ** 6, 10 ** 6) for _ in range(args.array_size)] for _ in range(args.arrays)]
+    if len(arrays) == 1:
+        rec.call("POST /sort", api, 'POST', "/sort", data={"array": arrays[0], "user_login": login})
+    else:
+        rec.call("POST /sort/batch", api, 'POST', "/sort/batch", data={"arrays": arrays, "user_login": login})
+
+def op_history(rec, api, login, args):
+    rec.call("GET /history", api, 'GET', f"/history/{login}", params={"limit": args.page_size})
+
+def op_slice(rec, api, login, args):
+    rec.call("GET /arrays", api, 'GET', f"/arrays/{login}", params={"start": 0, "end": 1})
+
+def op_patch(rec, api, login, args):
+    rec.call("PATCH /arrays", api, 'PATCH', f"/arrays/{login}",
+             params={"position": "end", "element": random.randint(-10 ** 6, 10 ** 6)})
+
+def op_delete(rec, api, login, args):
+    rec.call("DELETE /arrays", api, 'DELETE', f"/arrays/{login}", params={"index": 0})
+
+def op_login(rec, api, login, args):
+    rec.call("POST /users/login", api, 'POST', "/users/login", data={"login": login, "password": args.password})
+
+
+OPERATIONS = {
+    "sort": op_sort,
+    "history": op_history,
+    "slice": op_slice,
+    "patch": op_patch,
+    "delete": op_delete,
+    "login": op_login,
+}
+
+
+def virtual_user(rec: Recorder, api: ApiClient, args, weights: Dict[str, int], deadline: float):
+    login = f"load_{uuid.uuid4().hex[:12]}"
+    rec.call("POST /users", api, 'POST', "/users", data={"login": login, "password": args.password, "role": "load"})
+    op_login(rec, api, login, args)
+    # Первая сортировка, чтобы у пользователя была история
+    op_sort(rec, api, login, args)
+
+    names = list(weights)
+    for i in range(args.iterations):
+        if time.monotonic() >= deadline:
+            break
+        name = random.choices(names, weights=[weights[n] for n in names])[0]
+        OPERATIONS[name](rec, api, login, args)
+
+
+def run(args) -> dict:
+    weights = parse_mix(args.mix)
+    # Кэш ETag клиента по умолчанию выключен: иначе чтения истории измеряются как ответы 304
+    api = ApiClient(args.base_url, timeout=args.timeout, retries=0, pool_size=args.users,
+                    cache_size=args.client_cache)
+    rec = Recorder()
+    started = time.monotonic()
+    deadline = started + args.duration if args.duration else float('inf')
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        futures = [pool.submit(virtual_user, rec, api, args, weights, deadline) for _ in range(args.users)]
+        for future in futures:
+            future.result()
+    api.close()
+    report = rec.report(time.monotonic() - started)
+    report["client_cache"] = args.client_cache
+    return report
+
+
+def print_report(report: dict):
+    print(f"Запросов: {report['requests']} за {report['duration_s']:.2f} с "
+          f"({report['throughput_rps']:.1f} запр/с)")
+    print(f"Кэш ETag клиента: {report['client_cache'] or 'выключен'}")
+    print(f"{'эндпоинт':<20}{'кол-во':>8}{'ошибки':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for name, stats in report["endpoints"].items():
+        print(f"{name:<20}{stats['count']:>8}{stats['errors']:>8}"
+              f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование сервера сортировки")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=10, help="количество виртуальных пользователей")
+    parser.add_argument("--iterations", type=int, default=100, help="операций на пользователя")
+    parser.add_argument("--duration", type=float, default=0, help="ограничение по времени, с (0 — без ограничения)")
+    parser.add_argument("--array-size", type=int, default=100, help="размер сортируемого массива")
+    parser.add_argument("--arrays", type=int, default=1, help="массивов за одну сортировку (>1 — /sort/batch)")
+    parser.add_argument("--page-size", type=int, default=100, help="размер страницы истории")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="веса операций: " + ", ".join(OPERATIONS))
+    parser.add_argument("--password", default="LoadTest12345")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--client-cache", type=int, default=0,
+                        help="размер кэша ETag клиента (0 — выключен, чтения идут полностью)")
+    parser.add_argument("--json", dest="json_path", help="сохранить отчёт в JSON-файл")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+from contextlib import contextmanager
+from typing import Dict
+import os
+import threading
+import time
+from storage import shard
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки работают только внутри одного процесса
+    fcntl = None
+
+
+# Блокировка чтения/записи внутри процесса (используется, когда нет fcntl)
+class _RWLock:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+# Менеджер блокировок по логину: чтения одного пользователя идут параллельно,
+# записи одного пользователя выполняются по очереди, разные пользователи не мешают друг другу.
+# Между воркерами uvicorn блокировки согласуются через flock на файлах {folder}/{shard}/{login}.lock.
+# Повторный захват тем же потоком не блокируется (вложенные вызовы хранилища истории).
+class LockManager:
+    def __init__(self, folder_path: str = 'history/.locks'):
+        self.folder_path = folder_path
+        self._local = threading.local()
+        self._rw_locks: Dict[str, _RWLock] = {}
+        self._guard = threading.Lock()
+        self._stats = {
+            "read": {"count": 0, "wait_total_ms": 0.0, "wait_max_ms": 0.0},
+            "write": {"count": 0, "wait_total_ms": 0.0, "wait_max_ms": 0.0},
+        }
+
+    def _held(self) -> Dict[str, list]:
+        if not hasattr(self._local, "held"):
+            self._local.held = {}  # login -> [mode, depth, handle]
+        return self._local.held
+
+    def _record_wait(self, mode: str, waited_ms: float):
+        with self._guard:
+            stats = self._stats[mode]
+            stats["count"] += 1
+            stats["wait_total_ms"] += waited_ms
+            stats["wait_max_ms"] = max(stats["wait_max_ms"], waited_ms)
+
+    def _acquire(self, login: str, mode: str):
+        if fcntl is not None:
+            folder = os.path.join(self.folder_path, shard(login))
+            os.makedirs(folder, exist_ok=True)
+            handle = open(os.path.join(folder, f"{login}.lock"), 'a')
+            fcntl.flock(handle, fcntl.LOCK_SH if mode == "read" else fcntl.LOCK_EX)
+            return handle
+        with self._guard:
+            rw_lock = self._rw_locks.setdefault(login, _RWLock())
+        if mode == "read":
+            rw_lock.acquire_read()
+        else:
+            rw_lock.acquire_write()
+        return rw_lock
+
+    def _release(self, handle, mode: str):
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+        elif mode == "read":
+            handle.release_read()
+        else:
+            handle.release_write()
+
+    @contextmanager
+    def _locked(self, login: str, mode: str):
+        held = self._held()
+        if login in held:
+            if mode == "write" and held[login][0] == "read":
+                raise RuntimeError(f"Cannot upgrade read lock to write lock for {login}")
+            held[login][1] += 1
+            try:
+                yield
+            finally:
+                held[login][1] -= 1
+            return
+
+        started = time.perf_counter()
+        handle = self._acquire(login, mode)
+        self._record_wait(mode, (time.perf_counter() - started) * 1000)
+        held[login] = [mode, 1, handle]
+        try:
+            yield
+        finally:
+            del held[login]
+            self._release(handle, mode)
+
+    def read(self, login: str):
+        return self._locked(login, "read")
+
+    def write(self, login: str):
+        return self._locked(login, "write")
+
+    def stats(self) -> Dict[str, dict]:
+        with self._guard:
+            return {mode: dict(stats) for mode, stats in self._stats.items()}
@@ -1,12 +1,37 @@
 from typing import Union, List, Dict
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Request, Query, Depends
 from pydantic import BaseModel
 import json
 import time
 import os
 import hashlib
+import hmac
 import base64
-import bcrypt
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response
+import sort_engine
+from sort_engine import cached_sort, run_sort_many, sort_cache, insert_sorted, is_sorted
+from storage import UserExists
+from user_store import UserStore
+from history_store import HistoryStore
+from lock_manager import LockManager
+from id_allocator import IdAllocator
+from sqlite_store import SqliteDatabase, SqliteUserStore, SqliteHistoryStore
+from history_cache import HistoryCache
+from history_stats import HistoryStats
+from history_search import HistorySearch
+from history_versions import HistoryVersions
+from sort_jobs import SortJob, SortJobQueue, QueueFull, JOB_MAX_ELEMENTS, JOB_INLINE_MAX_SIZE
+from external_sort import (ExternalSorter, UploadNotFound, UploadClosed, UPLOAD_CHUNK_MAX_ELEMENTS,
+                           UPLOAD_STORE_MAX_ELEMENTS, EXTERNAL_SORT_AVAILABLE)
+import passwords
+from session_cache import SessionCache, SESSION_TTL, SESSION_REVALIDATE
+from metrics import metrics, SamplingProfiler
+import formats
+from formats import FastJSONResponse, respond, pack_array, pack_arrays
 
 class User(BaseModel):
     login: str
@@ -14,6 +39,7 @@ class User(BaseModel):
     role: str
     id: Union[int, None] = None
     token: Union[str, None] = None
+    token_issued: Union[float, None] = None  # время выдачи токена (time.time())
 
 class LogoutRequest(BaseModel):
     login: str
@@ -35,216 +61,670 @@ class ChangePasswordRequest(BaseModel):
 class SortRequest(BaseModel):
     array: List[int]
     user_login: str
+    algorithm: Union[str, None] = None
 
 
-class TextData(BaseModel):
-    text_id: Union[int, None] = None
-    content: str
+class BatchSortRequest(BaseModel):
+    arrays: List[List[int]]
+    user_login: str
+    algorithm: Union[str, None] = None
 
+# Ограничения пакетной сортировки
+BATCH_MAX_ARRAYS = int(os.environ.get("BATCH_MAX_ARRAYS", "10000"))
+BATCH_MAX_ELEMENTS = int(os.environ.get("BATCH_MAX_ELEMENTS", "5000000"))
 
-app = FastAPI()
+# Профилирование отдельного запроса по заголовку "X-Profile: 1" (только если разрешено)
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED") == "1"
+PROFILES_FOLDER = os.environ.get("PROFILES_FOLDER", "profiles/")
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+# Максимальный размер страницы истории
+HISTORY_PAGE_MAX = int(os.environ.get("HISTORY_PAGE_MAX", "1000"))
 
-def verify_password(password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+# Сжатие ответов gzip, если клиент прислал "Accept-Encoding: gzip" (ответы меньше GZIP_MIN_SIZE байт не сжимаются)
+GZIP_MIN_SIZE = int(os.environ.get("GZIP_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
 
-def generate_token(user_id: int) -> str:
-    return base64.urlsafe_b64encode(
+
+class TextData(BaseModel):
+    text_id: Union[int, None] = None
+    content: str
+
+
+app = FastAPI(default_response_class=FastJSONResponse)
+
+# Пул bcrypt перегружен (passwords.BCRYPT_MAX_PENDING) — клиенту стоит повторить позже
+@app.exception_handler(passwords.PasswordPoolBusy)
+async def password_pool_busy(request: Request, e: passwords.PasswordPoolBusy):
+    return FastJSONResponse({"detail": str(e)}, status_code=503, headers={"Retry-After": "1"})
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=GZIP_LEVEL)
+# Хранилище: "files" — каталоги users/ и history/, "sqlite" — база SQLite (SQLITE_PATH)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "files")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "storage.db")
+
+if STORAGE_BACKEND == "sqlite":
+    database = SqliteDatabase(SQLITE_PATH)
+    locks = LockManager(SQLITE_PATH + '.locks')
+    users = SqliteUserStore(database)
+    user_ids = IdAllocator(SQLITE_PATH + '.ids')
+    history_versions = HistoryVersions(SQLITE_PATH + '.versions')
+    history = SqliteHistoryStore(database, locks)
+else:
+    locks = LockManager('history/.locks')
+    users = UserStore('users/')
+    user_ids = IdAllocator('users/_next_id')
+    history_versions = HistoryVersions('history/.versions')
+    history = HistoryStore('history/', locks)
+
+# Кэш истории в памяти: "off" (по умолчанию), "write-behind" (отложенная запись) или "write-through".
+# Кэш у каждого процесса свой: воркеры uvicorn не видят изменений друг друга и при сбросе
+# затирают их, а ETag отдавался бы для устаревшей копии. Включать только при одном воркере.
+HISTORY_CACHE = os.environ.get("HISTORY_CACHE", "off")
+history_cache = HistoryCache(history, HISTORY_CACHE) if HISTORY_CACHE != "off" else None
+if history_cache is not None:
+    history = history_cache
+history_stats = HistoryStats(history, history_versions)
+history_search = HistorySearch(history, history_versions)
+sessions = SessionCache()
+
+# Задержка и количество запросов по маршрутам
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    if PROFILING_ENABLED and request.headers.get("X-Profile") == "1":
+        with SamplingProfiler() as profiler:
+            response = await call_next(request)
+        os.makedirs(PROFILES_FOLDER, exist_ok=True)
+        profile_path = os.path.join(PROFILES_FOLDER, f"profile_{int(time.time() * 1000)}.txt")
+        with open(profile_path, 'w') as f:
+            f.write(profiler.report())
+        response.headers["X-Profile-File"] = profile_path
+    else:
+        response = await call_next(request)
+
+    route = request.scope.get("route")
+    route_path = route.path if route is not None else "unmatched"
+    metrics.observe_request(request.method, route_path, response.status_code, time.perf_counter() - started)
+    return response
+
+@app.on_event("startup")
+def load_user_index():
+    users.load()
+
+@app.on_event("shutdown")
+def stop_workers():
+    sort_jobs.shutdown()
+    history.shutdown()
+    passwords.shutdown()
+    sort_engine.shutdown()
+
+# Токен начинается с логина (base64) — по нему токен без записи в кэше сессий
+# проверяется по файлу пользователя
+def generate_token(user_id: int, login: str) -> str:
+    digest = base64.urlsafe_b64encode(
         hashlib.sha256(f"{user_id}-{time.time()}".encode()).digest()
     ).decode()
+    return base64.urlsafe_b64encode(login.encode()).decode().rstrip('=') + '.' + digest
 
-def load_json(file_path: str):
+def token_login(token: str) -> Union[str, None]:
+    prefix, separator, _ = token.partition('.')
+    if not separator:
+        return None  # токен старого формата
     try:
-        with open(file_path, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
+        return base64.urlsafe_b64decode(prefix + '=' * (-len(prefix) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
         return None
 
-def save_json(file_path: str, data):
-    with open(file_path, 'w') as f:
-        json.dump(data, f)
+def issue_token(user: dict) -> None:
+    user['token'] = generate_token(user['id'], user['login'])
+    user['token_issued'] = time.time()
+
+# Сколько секунд ещё действует токен пользователя: срок SESSION_TTL считается от выдачи
+def token_ttl(user: dict) -> float:
+    issued = user.get('token_issued')
+    if not user.get('token') or issued is None:
+        return 0.0
+    return issued + SESSION_TTL - time.time()
+
+# Запись в кэше живёт не дольше срока токена и не дольше SESSION_REVALIDATE
+def cache_session(user: dict) -> None:
+    sessions.put(user['token'], user['login'], min(token_ttl(user), SESSION_REVALIDATE))
 
 # Регистрация пользователя
 @app.post("/users")
-def create_user(user: User):
-    user.id = int(time.time())
-    user.token = generate_token(user.id)
-    user.password = hash_password(user.password) 
+async def create_user(user: User):
+    if await run_in_threadpool(users.exists, user.login):
+        raise HTTPException(status_code=409, detail="User already exists")
 
-    print(f"Hashed password: {user.password}")
-
-    folder_path = 'users/'
-    os.makedirs(folder_path, exist_ok=True)
+    user.id = await run_in_threadpool(user_ids.next_id)
+    user.token = generate_token(user.id, user.login)
+    user.token_issued = time.time()
+    user.password = await passwords.hash_password_async(user.password)
 
-    for file in os.listdir(folder_path):
-        if file.endswith('.json'):
-            file_path = os.path.join(folder_path, file)
-            existing_user = load_json(file_path)
-            if existing_user and existing_user.get('login') == user.login:
-                raise HTTPException(status_code=409, detail="User already exists")
+    print(f"Hashed password: {user.password}")
 
-    save_json(f"users/user_{user.id}.json", user.dict())
+    try:
+        await run_in_threadpool(users.add, user.dict())
+    except UserExists:
+        raise HTTPException(status_code=409, detail="User already exists")
+    cache_session(user.dict())
     return {"message": "User registered successfully", "token": user.token}
 
 # Авторизация пользователя
 @app.post("/users/login")
-def login_user(data: LoginPassword):
-    
-    folder_path = 'users/'
-
-    for file in os.listdir(folder_path):
-     
-        if file.endswith('.json'):
-            file_path = os.path.join(folder_path, file)
-            user = load_json(file_path)
-        
-            if user and user['login'] == data.login:
-                stored_password = user['password']
-                
-                print(f"Stored hashed password: {stored_password}")
-                print(f"Input password: {data.password}")
-
-                if verify_password(data.password, stored_password):
-                    return {"message": "Login successful", "token": user['token']}
+async def login_user(data: LoginPassword):
+    user = await run_in_threadpool(users.get, data.login)
+    if user:
+        stored_password = user['password']
+
+        print(f"Stored hashed password: {stored_password}")
+        print(f"Input password: {data.password}")
+
+        if await passwords.verify_password_async(data.password, stored_password):
+            # Хеш со старой стоимостью пересчитываем, пока пароль известен
+            if passwords.needs_rehash(stored_password):
+                user['password'] = await passwords.hash_password_async(data.password)
+                await run_in_threadpool(users.save, user)
+            # После выхода или истечения срока токена выдаём новый
+            if token_ttl(user) <= 0:
+                issue_token(user)
+                await run_in_threadpool(users.save, user)
+            cache_session(user)
+            return {"message": "Login successful", "token": user['token']}
     
     raise HTTPException(status_code=401, detail="Invalid login or password")
 
 @app.post("/users/logout")
 def logout_user(request_data: LogoutRequest):
-    folder_path = 'users/'
-    for file in os.listdir(folder_path):
-        if file.endswith('.json'):
-            file_path = os.path.join(folder_path, file)
-            user = load_json(file_path)
-            if user and user['login'] == request_data.login:
-                user['token'] = None  # Удаляем токен
-                save_json(file_path, user)
-                return {"message": "Logout successful"}
+    user = users.get(request_data.login)
+    if user:
+        sessions.discard(user['token'])
+        user['token'] = None  # Удаляем токен
+        user['token_issued'] = None
+        users.save(user)
+        return {"message": "Logout successful"}
     
     raise HTTPException(status_code=404, detail="User not found")
 
-# Сортировка массива
-@app.post("/sort")
-def sort_array(sort_request: SortRequest):
+# Проверка токена (заголовок "Authorization: Bearer <token>"). Обычно по кэшу без обращения
+# к диску; при промахе (перезапуск, другой воркер, вытеснение, SESSION_REVALIDATE) — по записи
+# пользователя: токен должен совпадать с сохранённым и не быть старше SESSION_TTL.
+@app.get("/users/session")
+def check_session(authorization: Union[str, None] = Header(None)):
+    token = authorization[len("Bearer "):] if authorization and authorization.startswith("Bearer ") else authorization
+    login = sessions.get(token) if token else None
+    if login is None and token:
+        login = token_login(token)
+        user = users.get(login) if login else None
+        if user is None or not hmac.compare_digest(user.get('token') or '', token) or token_ttl(user) <= 0:
+            raise HTTPException(status_code=401, detail="Invalid or expired token")
+        cache_session(user)
+    if login is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return {"login": login}
+
+@app.get("/users/sessions/stats")
+def get_session_stats():
+    return sessions.stats()
+
+# Разбор тела /sort. JSON и msgpack проверяются моделью SortRequest;
+# двоичное тело (int64 little-endian) уже содержит целые числа и проверку поэлементно не проходит,
+# user_login и algorithm для него передаются в query-параметрах.
+async def read_sort_request(request: Request, user_login: Union[str, None], algorithm: Union[str, None]) -> SortRequest:
+    media_type = formats.body_format(request)
+    body = await request.body()
+    try:
+        if media_type == formats.BINARY:
+            if user_login is None:
+                raise HTTPException(status_code=400, detail="user_login query parameter is required for binary body")
+            return SortRequest.construct(array=formats.unpack_array(body), user_login=user_login, algorithm=algorithm)
+        return SortRequest.parse_obj(formats.decode_body(body, media_type))
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Сортировка массива и сохранение результата в историю.
+# pooled=True — сортировка в пуле процессов (фоновые задачи).
+# Возвращает (отсортированный массив, алгоритм, мс, позиция в истории).
+def sort_and_store(sort_request: SortRequest, pooled: bool = False):
     array = sort_request.array
     user_login = sort_request.user_login
     print(user_login)
     if not array:
         raise HTTPException(status_code=400, detail="Array cannot be empty")
 
-    # Гномья сортировка
-    def gnome_sort(arr):
-        index = 0
-        while index < len(arr):
-            if index == 0:
-                index += 1
-            if arr[index] >= arr[index - 1]:
-                index += 1
-            else:
-                arr[index], arr[index - 1] = arr[index - 1], arr[index]
-                index -= 1
-        return arr
-
-    sorted_array = gnome_sort(array)
-    history_file = f"history/{user_login}_history.json"
-    
+    try:
+        sorted_array, algorithm, elapsed_ms = cached_sort(array, sort_request.algorithm, pooled)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     # Добавление отсортированного массива в историю
-    history = load_json(history_file) or []
-    history.append(sorted_array)
-    save_json(history_file, history)
+    position = append_history(user_login, [sorted_array])
+
+    return sorted_array, algorithm, elapsed_ms, position
+
+# Добавление массивов в историю вместе со статистикой, поисковым индексом и версией (для ETag).
+# Возвращает позицию первого массива.
+def append_history(user_login: str, arrays: List[List[int]]) -> int:
+    with history.writing(user_login):
+        position = history.extend(user_login, arrays)
+        version = history_versions.bump(user_login)
+        history_stats.append(user_login, arrays, version)
+        history_search.append(user_login, arrays, version)
+    return position
+
+# Сортировка массива. Тело: JSON (SortRequest), msgpack или application/octet-stream;
+# формат ответа выбирается по заголовку Accept
+@app.post("/sort", openapi_extra={"requestBody": {"content": {
+    "application/json": {"schema": SortRequest.schema()},
+    formats.MSGPACK: {"schema": {"type": "string", "format": "binary"}},
+    formats.BINARY: {"schema": {"type": "string", "format": "binary"}},
+}}})
+async def sort_array(request: Request, user_login: Union[str, None] = None, algorithm: Union[str, None] = None):
+    sort_request = await read_sort_request(request, user_login, algorithm)
+    sorted_array, algorithm, elapsed_ms, _ = await run_in_threadpool(sort_and_store, sort_request)
+    return respond(
+        request,
+        {"sorted_array": sorted_array, "algorithm": algorithm, "elapsed_ms": elapsed_ms},
+        binary=lambda: pack_array(sorted_array),
+        headers={"X-Sort-Algorithm": algorithm, "X-Sort-Elapsed-Ms": f"{elapsed_ms:.3f}"},
+    )
+
+# Фоновые задачи сортировки: результат добавляется в историю по завершении
+def run_sort_job(job: SortJob):
+    return sort_and_store(SortRequest.construct(array=job.array, user_login=job.login, algorithm=job.algorithm), pooled=True)
+
+sort_jobs = SortJobQueue(run_sort_job)
+
+# Сортировка фоновой задачей. Тело — как у /sort. Массивы до JOB_INLINE_MAX_SIZE элементов
+# сортируются сразу (ответ 200 с результатом), остальные ставятся в очередь:
+# ответ 202 с job_id, состояние и результат — GET /sort/jobs/{job_id}.
+# Переполненная очередь отвечает 429 с заголовком Retry-After.
+@app.post("/sort/jobs", status_code=202, openapi_extra={"requestBody": {"content": {
+    "application/json": {"schema": SortRequest.schema()},
+    formats.MSGPACK: {"schema": {"type": "string", "format": "binary"}},
+    formats.BINARY: {"schema": {"type": "string", "format": "binary"}},
+}}})
+async def create_sort_job(request: Request, user_login: Union[str, None] = None, algorithm: Union[str, None] = None):
+    sort_request = await read_sort_request(request, user_login, algorithm)
+    array = sort_request.array
+    if not array:
+        raise HTTPException(status_code=400, detail="Array cannot be empty")
+    if len(array) > JOB_MAX_ELEMENTS:
+        raise HTTPException(status_code=413, detail=f"Array cannot contain more than {JOB_MAX_ELEMENTS} elements")
+    if sort_request.algorithm is not None:
+        try:
+            sort_engine.check_algorithm(array, sort_request.algorithm)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    if len(array) <= JOB_INLINE_MAX_SIZE:
+        job = SortJob(sort_request.user_login, array, sort_request.algorithm)
+        job.finish(*await run_in_threadpool(sort_and_store, sort_request))
+        sort_jobs.add_completed(job)
+        return FastJSONResponse(job.to_dict(), status_code=200)
 
-    return {"sorted_array": sorted_array}
+    try:
+        job = sort_jobs.submit(sort_request.user_login, array, sort_request.algorithm)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    return FastJSONResponse(job.to_dict(), status_code=202, headers={"Location": f"/sort/jobs/{job.id}"})
+
+@app.get("/sort/jobs/stats")
+def get_sort_job_stats():
+    return sort_jobs.stats()
+
+@app.get("/sort/jobs/{job_id}")
+def get_sort_job(request: Request, job_id: str):
+    job = sort_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    data = job.to_dict()
+    # sorted_array нет, если результат уже вытеснен: он доступен в истории по history_index
+    binary = (lambda: pack_array(data["sorted_array"])) if "sorted_array" in data else None
+    return respond(request, data, binary=binary)
+
+# Внешняя сортировка массивов больше памяти: загрузка по частям.
+# POST /sort/uploads?user_login=... — новая загрузка;
+# POST /sort/uploads/{upload_id}/chunks — часть массива (application/octet-stream с int64
+# little-endian, либо JSON/msgpack: список чисел или {"array": [...]});
+# POST /sort/uploads/{upload_id}/finalize — отсортированный массив отдаётся потоком
+# (int64 при "Accept: application/octet-stream", иначе JSON), с store=true — сохраняется в историю.
+# Без NumPy загрузки недоступны: маршруты отвечают 501.
+uploads = ExternalSorter() if EXTERNAL_SORT_AVAILABLE else None
+
+def require_uploads():
+    if uploads is None:
+        raise HTTPException(status_code=501, detail="Chunked uploads require NumPy")
+
+def upload_error(e: Exception) -> HTTPException:
+    if isinstance(e, UploadNotFound):
+        return HTTPException(status_code=404, detail="Upload not found")
+    return HTTPException(status_code=409, detail="Upload is already finalized")
+
+@app.post("/sort/uploads", status_code=201, dependencies=[Depends(require_uploads)])
+def create_upload(user_login: str):
+    return uploads.create(user_login)
+
+@app.post("/sort/uploads/{upload_id}/chunks", dependencies=[Depends(require_uploads)], openapi_extra={"requestBody": {"content": {
+    formats.BINARY: {"schema": {"type": "string", "format": "binary"}},
+    "application/json": {"schema": {"type": "array", "items": {"type": "integer"}}},
+}}})
+async def add_upload_chunk(request: Request, upload_id: str):
+    media_type = formats.body_format(request)
+    body = await request.body()
+    try:
+        if media_type == formats.BINARY:
+            if len(body) % 8:
+                raise ValueError("Binary body length must be a multiple of 8 bytes")
+            data = body
+        else:
+            values = formats.decode_body(body, media_type)
+            if isinstance(values, dict):
+                values = values.get("array")
+            if not isinstance(values, list) or not all(isinstance(value, int) for value in values):
+                raise ValueError("Chunk must be a list of integers")
+            data = pack_array(values)
+    except OverflowError:
+        raise HTTPException(status_code=400, detail="Values must fit into int64")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(data) // 8 > UPLOAD_CHUNK_MAX_ELEMENTS:
+        raise HTTPException(status_code=413, detail=f"Chunk cannot contain more than {UPLOAD_CHUNK_MAX_ELEMENTS} elements")
 
-@app.get("/arrays/{user_login}")
-def get_array_slice(user_login: str, start: int, end: int):
-    history_file = f"history/{user_login}_history.json"
-    history = load_json(history_file)
-    if not history:
-        raise HTTPException(status_code=404, detail="History not found")
-    if start < 0 or end > len(history) or start >= end:
-        raise HTTPException(status_code=400, detail="Invalid indices")
-    return {"array_slice": history[start:end]}
+    try:
+        return await run_in_threadpool(uploads.add_chunk, upload_id, data)
+    except (UploadNotFound, UploadClosed) as e:
+        raise upload_error(e)
 
-@app.patch("/arrays/{user_login}")
-def update_array(user_login: str, position: str, element: int, index: Union[int, None] = None):
-    history_file = f"history/{user_login}_history.json"
-    history = load_json(history_file)
-    if not history:
-        raise HTTPException(status_code=404, detail="History not found")
+@app.get("/sort/uploads/{upload_id}", dependencies=[Depends(require_uploads)])
+def get_upload(upload_id: str):
+    try:
+        return uploads.get(upload_id)
+    except UploadNotFound as e:
+        raise upload_error(e)
 
-    # Последний массив в истории
-    if not history:
-        raise HTTPException(status_code=400, detail="No arrays in history to modify")
-    
-    array = history[-1]  # Последний массив в истории
-    
-    # Добавление элемента в массив
-    if position == "start":
-        array.insert(0, element)
-    elif position == "end":
-        array.append(element)
-    elif position == "after":
-        if index is None or index < 0 or index >= len(array):
-            raise HTTPException(status_code=400, detail="Invalid index for insertion")
-        array.insert(index + 1, element)
+@app.post("/sort/uploads/{upload_id}/finalize", dependencies=[Depends(require_uploads)])
+def finalize_upload(request: Request, upload_id: str, store: bool = False):
+    try:
+        if store:
+            elements = uploads.get(upload_id)["elements"]
+            if elements > UPLOAD_STORE_MAX_ELEMENTS:
+                raise HTTPException(status_code=413, detail=f"Cannot store more than {UPLOAD_STORE_MAX_ELEMENTS} elements in history")
+            if not elements:
+                uploads.abort(upload_id)
+                raise HTTPException(status_code=400, detail="Array cannot be empty")
+        meta, blocks = uploads.finalize(upload_id)
+    except (UploadNotFound, UploadClosed) as e:
+        raise upload_error(e)
+    headers = {"X-Total-Elements": str(meta["elements"])}
+
+    if store:
+        sorted_array = [value for block in blocks for value in block.tolist()]
+        position = append_history(meta["user_login"], [sorted_array])
+        return FastJSONResponse({"upload_id": upload_id, "elements": len(sorted_array), "history_index": position},
+                                headers=headers)
+
+    if formats.response_format(request) == formats.BINARY:
+        return StreamingResponse((block.tobytes() for block in blocks), media_type=formats.BINARY, headers=headers)
+
+    def json_lines():
+        yield '{"sorted_array": ['
+        separator = ''
+        for block in blocks:
+            yield separator + ', '.join(map(str, block.tolist()))
+            separator = ', '
+        yield ']}'
+    return StreamingResponse(json_lines(), media_type="application/json", headers=headers)
+
+@app.delete("/sort/uploads/{upload_id}", dependencies=[Depends(require_uploads)])
+def abort_upload(upload_id: str):
+    try:
+        if not uploads.abort(upload_id):
+            raise UploadNotFound(upload_id)
+    except UploadNotFound as e:
+        raise upload_error(e)
+    return {"message": "Upload deleted successfully"}
+
+# Пакетная сортировка: массивы сортируются параллельно и добавляются в историю одной записью
+@app.post("/sort/batch")
+def sort_batch(batch_request: BatchSortRequest):
+    arrays = batch_request.arrays
+    if not arrays:
+        raise HTTPException(status_code=400, detail="Batch cannot be empty")
+    if any(not array for array in arrays):
+        raise HTTPException(status_code=400, detail="Array cannot be empty")
+    if len(arrays) > BATCH_MAX_ARRAYS:
+        raise HTTPException(status_code=413, detail=f"Batch cannot contain more than {BATCH_MAX_ARRAYS} arrays")
+    if sum(len(array) for array in arrays) > BATCH_MAX_ELEMENTS:
+        raise HTTPException(status_code=413, detail=f"Batch cannot contain more than {BATCH_MAX_ELEMENTS} elements")
+
+    started = time.perf_counter()
+    try:
+        with metrics.timer("sort_batch"):
+            results = run_sort_many(arrays, batch_request.algorithm)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    append_history(batch_request.user_login, [sorted_array for sorted_array, _, _ in results])
+
+    return {
+        "results": [
+            {"sorted_array": sorted_array, "algorithm": algorithm, "elapsed_ms": array_elapsed_ms}
+            for sorted_array, algorithm, array_elapsed_ms in results
+        ],
+        "elapsed_ms": elapsed_ms,
+    }
+
+# ETag истории: версия истории пользователя (увеличивается при каждом изменении) и формат ответа.
+# ETag слабый: тело может быть сжато gzip или нет, а данные те же.
+# Версия читается до данных: если история изменится между ними, клиент получит
+# новые данные со старым ETag и просто перезапросит их, но не наоборот.
+def history_etag(request: Request, user_login: str) -> str:
+    media_type = formats.response_format(request)
+    return f'W/"{history_versions.get(user_login)}-{media_type.rsplit("/", 1)[-1]}"'
+
+def etag_headers(etag: str) -> Dict[str, str]:
+    return {"ETag": etag, "Vary": "Accept", "Cache-Control": "no-cache"}
+
+# Проверка If-None-Match: клиент уже получил эту версию — ответ 304 без тела
+def not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(',')]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+@app.get("/arrays/{user_login}")
+def get_array_slice(request: Request, user_login: str, start: int, end: int):
+    with history.reading(user_login):
+        etag = history_etag(request, user_login)
+        count = history.count(user_login)
+        if not count:
+            raise HTTPException(status_code=404, detail="History not found")
+        if start < 0 or end > count or start >= end:
+            raise HTTPException(status_code=400, detail="Invalid indices")
+        if not_modified(request, etag):
+            return Response(status_code=304, headers=etag_headers(etag))
+        array_slice = history.read_range(user_login, start, end)
+    return respond(request, {"array_slice": array_slice}, binary=lambda: pack_arrays(array_slice),
+                   headers=etag_headers(etag))
+
+# Вставка в последний массив истории. Один элемент передаётся query-параметрами
+# position и element, несколько — телом Update_array_client.
+# position: start, end, after (после index) или sorted (с сохранением порядка сортировки).
+@app.patch("/arrays/{user_login}")
+def update_array(user_login: str, position: Union[str, None] = None, element: Union[int, None] = None,
+                 index: Union[int, None] = None, body: Union[Update_array_client, None] = None):
+    if body is not None:
+        position, elements = body.position, body.element
+    elif position is not None and element is not None:
+        elements = [element]
     else:
-        raise HTTPException(status_code=400, detail="Invalid position")
-    
-    # Обновляем последний массив в истории
-    history[-1] = array
-    save_json(history_file, history)
+        raise HTTPException(status_code=400, detail="position and element are required")
+    if not elements:
+        raise HTTPException(status_code=400, detail="No elements to insert")
+
+    with history.writing(user_login):
+        count = history.count(user_login)
+        if not count:
+            raise HTTPException(status_code=404, detail="History not found")
+
+        array = history.get(user_login, count - 1)  # Последний массив в истории
+
+        # Добавление элементов в массив
+        if position == "start":
+            array[0:0] = elements
+        elif position == "end":
+            array.extend(elements)
+        elif position == "after":
+            if index is None or index < 0 or index >= len(array):
+                raise HTTPException(status_code=400, detail="Invalid index for insertion")
+            array[index + 1:index + 1] = elements
+        elif position == "sorted":
+            if not is_sorted(array):
+                raise HTTPException(status_code=400, detail="Array is not sorted")
+            insert_sorted(array, elements)
+        else:
+            raise HTTPException(status_code=400, detail="Invalid position")
+
+        # Обновляем последний массив в истории
+        history.replace(user_login, count - 1, array)
+        version = history_versions.bump(user_login)
+        history_stats.replace(user_login, count - 1, array, version)
+        history_search.add_values(user_login, count - 1, array, elements, version)
 
     return {"updated_array": array}
 
-# Получение истории сортировок
+# Получение истории сортировок.
+# stream=true — отдача NDJSON по мере чтения с диска (по массиву на строку);
+# limit (и cursor) — постраничная выдача, next_cursor указывает на следующую страницу.
+# Ответ содержит ETag; запрос с If-None-Match той же версии получает 304 без тела.
 @app.get("/history/{user_login}")
-def get_sort_history(user_login: str):
-    history_file = f"history/{user_login}_history.json"
-    history = load_json(history_file)
-    if history:
-        return {"history": history}
-    raise HTTPException(status_code=404, detail="History not found")
+def get_sort_history(request: Request, user_login: str, stream: bool = False, cursor: Union[int, None] = None, limit: Union[int, None] = None):
+    etag = history_etag(request, user_login)
+    count = history.count(user_login)
+    if not count:
+        raise HTTPException(status_code=404, detail="History not found")
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    headers = etag_headers(etag)
+
+    if stream:
+        lines = (json.dumps(array) + "\n" for array in history.iter_all(user_login))
+        return StreamingResponse(lines, media_type="application/x-ndjson", headers=headers)
+
+    if cursor is None and limit is None:
+        arrays = history.read_all(user_login)
+        return respond(request, {"history": arrays}, binary=lambda: pack_arrays(arrays), headers=headers)
+
+    cursor = cursor or 0
+    limit = min(limit or HISTORY_PAGE_MAX, HISTORY_PAGE_MAX)
+    if cursor < 0 or limit <= 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor or limit")
+    page = history.read_range(user_login, cursor, cursor + limit)
+    next_cursor = cursor + len(page) if cursor + len(page) < count else None
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+    return respond(request, {"history": page, "next_cursor": next_cursor},
+                   binary=lambda: pack_arrays(page), headers=headers)
+
+# Статистика по истории: число массивов и элементов, длины массивов (min/max/mean/перцентили)
+# и значения (min/max/mean). Считается по сводке, которая обновляется при изменениях истории.
+@app.get("/history/{user_login}/stats")
+def get_history_stats(user_login: str):
+    stats = history_stats.get(user_login)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="History not found")
+    return stats
+
+# Поиск по истории: value — массивы, содержащие значение; min и/или max — значения из диапазона
+# (границы включительно). Для каждого найденного массива — его индекс и подходящие элементы:
+# в отсортированном массиве они идут подряд — start и end (не включается), в остальных — positions.
+@app.get("/history/{user_login}/search")
+def search_history(user_login: str, value: Union[int, None] = None,
+                   min_value: Union[int, None] = Query(None, alias="min"),
+                   max_value: Union[int, None] = Query(None, alias="max")):
+    if value is not None:
+        if min_value is not None or max_value is not None:
+            raise HTTPException(status_code=400, detail="Use either value or min/max")
+        min_value = max_value = value
+    elif min_value is None and max_value is None:
+        raise HTTPException(status_code=400, detail="value or min/max is required")
+    elif min_value is not None and max_value is not None and min_value > max_value:
+        raise HTTPException(status_code=400, detail="min cannot be greater than max")
+
+    matches = history_search.search(user_login, min_value, max_value)
+    if matches is None:
+        raise HTTPException(status_code=404, detail="History not found")
+    return {"matches": matches}
 
 @app.delete("/arrays/{user_login}")
 def delete_array_by_index(user_login: str, index: int):
-    history_file = f"history/{user_login}_history.json"
-    history = load_json(history_file)
-    if not history:
-        raise HTTPException(status_code=404, detail="History not found")
+    with history.writing(user_login):
+        count = history.count(user_login)
+        if not count:
+            raise HTTPException(status_code=404, detail="History not found")
 
-    if index < 0 or index >= len(history):
-        raise HTTPException(status_code=400, detail="Invalid index")
+        if index < 0 or index >= count:
+            raise HTTPException(status_code=400, detail="Invalid index")
 
-    deleted_array = history.pop(index)
-    save_json(history_file, history)
+        deleted_array = history.delete(user_login, index)
+        version = history_versions.bump(user_login)
+        history_stats.delete(user_login, index, version)
+        history_search.delete(user_login, index, deleted_array, version)
 
     return {"message": "Array deleted successfully", "deleted_array": deleted_array}
 
 
 @app.delete("/history/{user_login}")
 def delete_history(user_login: str):
-    history_file = f"history/{user_login}_history.json"
-    
-    if os.path.exists(history_file):
-        os.remove(history_file)  # Удаляем файл истории
+    with history.writing(user_login):
+        history_stats.discard(user_login)
+        history_search.discard(user_login)
+        deleted = history.delete_all(user_login)  # Удаляем файлы истории
+        if deleted:
+            history_versions.bump(user_login)
+    if deleted:
         return {"message": "History deleted successfully"}
     
     raise HTTPException(status_code=404, detail="History not found")
 
+# Время ожидания блокировок истории
+@app.get("/locks/stats")
+def get_lock_stats():
+    return locks.stats()
+
+# Статистика кэша результатов сортировки
+@app.get("/sort/cache/stats")
+def get_sort_cache_stats():
+    return sort_cache.stats()
+
+# Метрики в текстовом формате Prometheus
+@app.get("/metrics")
+def get_metrics():
+    lock_stats = locks.stats()
+    extra = {
+        "session_cache": ("gauge", sessions.stats()),
+        "sort_cache": ("gauge", sort_cache.stats()),
+        "sort_jobs": ("gauge", sort_jobs.stats()),
+        "bcrypt": ("gauge", passwords.stats()),
+        "history_cache": ("gauge", history_cache.stats() if history_cache is not None else {}),
+        "lock_wait_ms_total": ("counter", {mode: stats["wait_total_ms"] for mode, stats in lock_stats.items()}),
+        "lock_acquisitions_total": ("counter", {mode: stats["count"] for mode, stats in lock_stats.items()}),
+    }
+    return PlainTextResponse(metrics.render(extra), media_type="text/plain; version=0.0.4")
+
 # Изменение пароля
 @app.patch("/users/password")
-def change_password(request_data: ChangePasswordRequest):
-    folder_path = 'users/'
-    for file in os.listdir(folder_path):
-        if file.endswith('.json'):
-            file_path = os.path.join(folder_path, file)
-            user = load_json(file_path)
-            if user and user['login'] == request_data.login:
-                if verify_password(request_data.old_password, user['password']):
-                    user['password'] = hash_password(request_data.new_password)
-                    user['token'] = generate_token(user['id'])
-                    save_json(file_path, user)
-                    return {"message": "Password changed successfully", "new_token": user['token']}
+async def change_password(request_data: ChangePasswordRequest):
+    user = await run_in_threadpool(users.get, request_data.login)
+    if user and await passwords.verify_password_async(request_data.old_password, user['password']):
+        user['password'] = await passwords.hash_password_async(request_data.new_password)
+        sessions.discard(user['token'])
+        issue_token(user)
+        await run_in_threadpool(users.save, user)
+        cache_session(user)
+        return {"message": "Password changed successfully", "new_token": user['token']}
     raise HTTPException(status_code=401, detail="Invalid login or password")
@@ -0,0 +1,147 @@
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Tuple
+import inspect
+import os
+import sys
+import threading
+import time
+import traceback
+
+# Границы корзин гистограмм, секунды
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += 1
+        self.sum += value
+
+
+# Метрики процесса: задержки и количество запросов по маршрутам и время фаз обработки.
+# Каждый воркер uvicorn хранит и отдаёт свои метрики.
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: Counter = Counter()                    # (method, route, status) -> count
+        self.latency: Dict[Tuple[str, str], Histogram] = {}   # (method, route) -> histogram
+        self.phases: Dict[str, Histogram] = {}                # phase -> histogram
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        with self._lock:
+            self.requests[(method, route, str(status))] += 1
+            self.latency.setdefault((method, route), Histogram()).observe(seconds)
+
+    def observe_phase(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases.setdefault(phase, Histogram()).observe(seconds)
+
+    @contextmanager
+    def timer(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(phase, time.perf_counter() - started)
+
+    # Декоратор для замера фазы; работает и с обычными, и с async-функциями
+    def timed(self, phase: str):
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.timer(phase):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(phase):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # Текстовый формат Prometheus; extra: имя -> (тип метрики, {метка: значение})
+    def render(self, extra: Dict[str, Tuple[str, Dict[str, float]]] = None) -> str:
+        lines: List[str] = []
+        with self._lock:
+            lines.append("# HELP http_requests_total Total HTTP requests.")
+            lines.append("# TYPE http_requests_total counter")
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+
+            lines.append("# HELP http_request_duration_seconds HTTP request latency.")
+            lines.append("# TYPE http_request_duration_seconds histogram")
+            for (method, route), histogram in sorted(self.latency.items()):
+                _render_histogram(lines, "http_request_duration_seconds", f'method="{method}",route="{route}"', histogram)
+
+            lines.append("# HELP phase_duration_seconds Duration of request processing phases.")
+            lines.append("# TYPE phase_duration_seconds histogram")
+            for phase, histogram in sorted(self.phases.items()):
+                _render_histogram(lines, "phase_duration_seconds", f'phase="{phase}"', histogram)
+
+        for name, (metric_type, values) in (extra or {}).items():
+            lines.append(f"# TYPE {name} {metric_type}")
+            for label, value in values.items():
+                lines.append(f'{name}{{name="{label}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+def _render_histogram(lines: List[str], name: str, labels: str, histogram: Histogram):
+    cumulative = 0
+    for bound, count in zip(BUCKETS, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.total}')
+    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.total}')
+
+
+# Сэмплирующий профилировщик: пока запрос выполняется, фоновый поток
+# периодически снимает стеки всех потоков (включая пул потоков FastAPI).
+# Учитываются только стеки, проходящие через код приложения, — простаивающие потоки пропускаются.
+APP_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = traceback.extract_stack(frame)
+                if any(f.filename.startswith(APP_FOLDER) and f.filename != __file__ for f in stack):
+                    self.samples[";".join(f"{f.name} ({f.filename}:{f.lineno})" for f in stack)] += 1
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    # Свёрнутые стеки (формат flamegraph: "f1;f2;f3 count"), самые частые сверху
+    def report(self, limit: int = 50) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common(limit)) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,54 @@
+import argparse
+import os
+from storage import load_json, shard
+from user_store import UserStore
+
+HISTORY_SUFFIXES = ('_history.log', '_history.idx', '_history.json')
+
+
+# Перенос файлов из плоских каталогов users/ и history/ в подкаталоги по префиксу
+# хеша логина (storage.shard). Запускается один раз при остановленном сервере;
+# повторный запуск переносит только оставшиеся в корне файлы.
+def migrate(users_folder: str, history_folder: str):
+    user_count = 0
+    if os.path.isdir(users_folder):
+        for file in os.listdir(users_folder):
+            path = os.path.join(users_folder, file)
+            if not (file.startswith('user_') and file.endswith('.json')) or not os.path.isfile(path):
+                continue
+            user = load_json(path)
+            if not user or 'login' not in user:
+                print(f"Пропущен файл без логина: {path}")
+                continue
+            target_folder = os.path.join(users_folder, shard(user['login']))
+            os.makedirs(target_folder, exist_ok=True)
+            os.replace(path, os.path.join(target_folder, file))
+            user_count += 1
+        # Индекс хранит пути к файлам — перестраиваем его по новому расположению
+        UserStore(users_folder).load()
+
+    history_count = 0
+    if os.path.isdir(history_folder):
+        for file in os.listdir(history_folder):
+            path = os.path.join(history_folder, file)
+            suffix = next((s for s in HISTORY_SUFFIXES if file.endswith(s)), None)
+            if suffix is None or not os.path.isfile(path):
+                continue
+            target_folder = os.path.join(history_folder, shard(file[:-len(suffix)]))
+            os.makedirs(target_folder, exist_ok=True)
+            os.replace(path, os.path.join(target_folder, file))
+            history_count += 1
+
+    print(f"Перенесено файлов пользователей: {user_count}, файлов истории: {history_count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос users/ и history/ в подкаталоги по хешу логина")
+    parser.add_argument("--users", default="users/")
+    parser.add_argument("--history", default="history/")
+    args = parser.parse_args()
+    migrate(args.users, args.history)
+
+
+if __name__ == "__main__":
+    main()
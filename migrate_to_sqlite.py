@@ -0,0 +1,58 @@
+import argparse
+import os
+from storage import load_json, iter_shard_files
+from history_store import HistoryStore
+from sqlite_store import SqliteDatabase, SqliteUserStore, SqliteHistoryStore
+
+
+# Перенос пользователей и истории из каталогов users/ и history/ в базу SQLite.
+# Повторный запуск перезаписывает уже перенесённые данные.
+# Читаются и подкаталоги (см. migrate_layout.py), и старые файлы в корне каталогов.
+def migrate(users_folder: str, history_folder: str, db_path: str):
+    db = SqliteDatabase(db_path)
+    sqlite_users = SqliteUserStore(db)
+    sqlite_history = SqliteHistoryStore(db)
+
+    user_count = 0
+    for file in iter_shard_files(users_folder):
+        if not (os.path.basename(file).startswith('user_') and file.endswith('.json')):
+            continue
+        user = load_json(os.path.join(users_folder, file))
+        if not user or 'login' not in user:
+            continue
+        if sqlite_users.exists(user['login']):
+            sqlite_users.save(user)
+        else:
+            sqlite_users.add(user)
+        user_count += 1
+
+    logins = set()
+    for file in iter_shard_files(history_folder):
+        for suffix in ('_history.idx', '_history.json'):
+            if file.endswith(suffix):
+                logins.add(os.path.basename(file)[:-len(suffix)])
+
+    file_history = HistoryStore(history_folder)
+    array_count = 0
+    for login in sorted(logins):
+        arrays = file_history.read_all(login)
+        sqlite_history.delete_all(login)
+        if arrays:
+            sqlite_history.extend(login, arrays)
+        array_count += len(arrays)
+    file_history.shutdown()
+
+    print(f"Перенесено пользователей: {user_count}, историй: {len(logins)}, массивов: {array_count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос данных из JSON-каталогов в SQLite")
+    parser.add_argument("--users", default="users/")
+    parser.add_argument("--history", default="history/")
+    parser.add_argument("--db", default="storage.db")
+    args = parser.parse_args()
+    migrate(args.users, args.history, args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+from array import array as int_array
+from typing import List
+import struct
+import sys
+
+# Двоичный формат массивов (общий для сервера и client.py, только стандартная библиотека)
+
+_LENGTH = struct.Struct('<q')
+
+
+# Упакованный массив: подряд идущие int64 little-endian
+def pack_array(values: List[int]) -> bytes:
+    packed = int_array('q', values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+def unpack_array(data: bytes) -> List[int]:
+    if len(data) % 8:
+        raise ValueError("Binary body length must be a multiple of 8 bytes")
+    packed = int_array('q')
+    packed.frombytes(data)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tolist()
+
+# Несколько массивов: перед каждым — его длина (int64 little-endian)
+def pack_arrays(arrays: List[List[int]]) -> bytes:
+    return b''.join(_LENGTH.pack(len(values)) + pack_array(values) for values in arrays)
+
+def unpack_arrays(data: bytes) -> List[List[int]]:
+    arrays = []
+    offset = 0
+    while offset < len(data):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        arrays.append(unpack_array(data[offset:offset + length * 8]))
+        offset += length * 8
+    return arrays
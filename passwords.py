@@ -0,0 +1,85 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+import asyncio
+import multiprocessing
+import os
+import threading
+import bcrypt
+from metrics import metrics
+
+# Стоимость bcrypt и размер пула процессов для хеширования настраиваются через окружение.
+# По умолчанию пул занимает половину ядер, чтобы поток входов не отнимал все ядра у /sort и /history.
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+BCRYPT_WORKERS = int(os.environ.get("BCRYPT_WORKERS", str(max(1, (os.cpu_count() or 1) // 2))))
+# Сколько операций bcrypt может выполняться и ждать в очереди пула; сверх этого — PasswordPoolBusy
+BCRYPT_MAX_PENDING = int(os.environ.get("BCRYPT_MAX_PENDING", str(BCRYPT_WORKERS * 8)))
+
+_pool = None
+_pending = 0
+_rejected = 0
+_pending_lock = threading.Lock()
+
+
+# Очередь пула bcrypt заполнена (обработчики отвечают 503)
+class PasswordPoolBusy(Exception):
+    pass
+
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+# Хеш создан с другой стоимостью (формат "$2b$12$...") — его нужно пересчитать
+def needs_rehash(hashed_password: str) -> bool:
+    try:
+        return int(hashed_password.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+# bcrypt выполняется в отдельном пуле процессов, чтобы не занимать
+# потоки обработчиков запросов и не упираться в GIL.
+# Процессы запускаются через forkserver: при fork они унаследовали бы открытые в этот момент
+# файлы с flock (блокировки истории, счётчик id, журнал пользователей) и держали бы блокировки.
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        context = multiprocessing.get_context("forkserver") if "forkserver" in multiprocessing.get_all_start_methods() else None
+        _pool = ProcessPoolExecutor(max_workers=BCRYPT_WORKERS, mp_context=context)
+    return _pool
+
+# Операция в пуле с ограничением числа незавершённых операций
+async def _run(func, *args):
+    global _pending, _rejected
+    with _pending_lock:
+        if _pending >= BCRYPT_MAX_PENDING:
+            _rejected += 1
+            raise PasswordPoolBusy(f"Too many password operations in progress (limit {BCRYPT_MAX_PENDING})")
+        _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_pool(), func, *args)
+    finally:
+        with _pending_lock:
+            _pending -= 1
+
+@metrics.timed("bcrypt_hash")
+async def hash_password_async(password: str) -> str:
+    return await _run(hash_password, password, BCRYPT_ROUNDS)
+
+@metrics.timed("bcrypt_verify")
+async def verify_password_async(password: str, hashed_password: str) -> bool:
+    return await _run(verify_password, password, hashed_password)
+
+def stats() -> Dict[str, int]:
+    with _pending_lock:
+        return {"workers": BCRYPT_WORKERS, "pending": _pending, "max_pending": BCRYPT_MAX_PENDING,
+                "rejected": _rejected}
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
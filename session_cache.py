@@ -0,0 +1,67 @@
+from collections import OrderedDict
+from typing import Dict, Union
+import os
+import threading
+import time
+
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "3600"))
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "100000"))
+# Сколько секунд доверять кэшу без перепроверки токена по записи пользователя:
+# выход и смена пароля в другом воркере становятся видны не позже чем через это время
+SESSION_REVALIDATE = float(os.environ.get("SESSION_REVALIDATE", "60"))
+
+
+# Кэш сессий token -> login с временем жизни и вытеснением давно не использованных (LRU).
+# Заполняется при регистрации и входе, очищается при выходе и смене пароля,
+# поэтому проверка токена обычно не читает файлы пользователей. Кэш свой у каждого процесса
+# и теряется при перезапуске: при промахе токен проверяется по записи пользователя (см. main).
+class SessionCache:
+    def __init__(self, max_size: int = SESSION_CACHE_SIZE, ttl: float = SESSION_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()  # token -> (login, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ttl — время жизни записи, если оно меньше стандартного (например, остаток срока токена)
+    def put(self, token: str, login: str, ttl: Union[float, None] = None) -> None:
+        with self._lock:
+            self._sessions[token] = (login, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._sessions.move_to_end(token)
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+
+    # Логин владельца токена или None, если токен неизвестен или истёк
+    def get(self, token: str) -> Union[str, None]:
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                self.misses += 1
+                return None
+            login, expires_at = session
+            if expires_at < time.monotonic():
+                del self._sessions[token]
+                self.misses += 1
+                return None
+            self._sessions.move_to_end(token)
+            self.hits += 1
+            return login
+
+    def discard(self, token: Union[str, None]) -> None:
+        if token is None:
+            return
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._sessions),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,67 @@
+from array import array as int_array
+from collections import OrderedDict
+from typing import Dict, List, Union
+import hashlib
+import os
+import threading
+
+SORT_CACHE_MAX_ELEMENTS = int(os.environ.get("SORT_CACHE_MAX_ELEMENTS", "2000000"))
+SORT_CACHE_MIN_SIZE = int(os.environ.get("SORT_CACHE_MIN_SIZE", "64"))  # меньшие массивы дешевле отсортировать
+
+
+# Ключ кэша — хеш содержимого массива
+def array_key(arr: List[int]) -> bytes:
+    try:
+        data = int_array('q', arr).tobytes()
+    except OverflowError:  # значения больше int64
+        data = repr(arr).encode()
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+# Кэш результатов сортировки по содержимому входного массива.
+# Размер ограничен суммарным числом хранимых элементов, вытесняются давно не использованные (LRU).
+class SortCache:
+    def __init__(self, max_elements: int = SORT_CACHE_MAX_ELEMENTS):
+        self.max_elements = max_elements
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.elements = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: bytes) -> Union[List[int], None]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return list(entry)
+
+    def put(self, key: bytes, sorted_array: List[int]) -> None:
+        if len(sorted_array) > self.max_elements:
+            return
+        entry = tuple(sorted_array)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.elements -= len(old)
+            self._entries[key] = entry
+            self.elements += len(entry)
+            while self.elements > self.max_elements:
+                _, evicted = self._entries.popitem(last=False)
+                self.elements -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "elements": self.elements,
+                "max_elements": self.max_elements,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
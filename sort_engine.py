@@ -0,0 +1,400 @@
+from typing import List, Callable, Dict, Union
+from concurrent.futures import ProcessPoolExecutor
+import bisect
+import multiprocessing
+import os
+import time
+from metrics import metrics
+from sort_cache import SortCache, array_key, SORT_CACHE_MIN_SIZE
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: без него векторизованный путь недоступен
+    np = None
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # без shared_memory параллельная сортировка одного массива недоступна
+    shared_memory = None
+
+# Пороги автоматического выбора алгоритма
+SMALL_ARRAY_SIZE = 32           # на маленьких массивах гномья сортировка не хуже остальных
+NUMPY_MIN_SIZE = 20_000         # начиная с этого размера выгоднее NumPy
+COUNTING_MIN_SIZE = 10_000      # counting sort окупается только на больших массивах
+COUNTING_MAX_RANGE_RATIO = 0.25 # ... и когда диапазон значений <= ratio * n (много повторов)
+PRESORTED_RUNS_RATIO = 0.05     # мало "разрывов" порядка — timsort отработает почти за O(n)
+# Ограничения явно выбранных алгоритмов: гномья сортировка — O(n^2),
+# counting sort выделяет память под весь диапазон значений
+GNOME_MAX_SIZE = int(os.environ.get("GNOME_MAX_SIZE", "2000"))
+COUNTING_MAX_RANGE = int(os.environ.get("COUNTING_MAX_RANGE", "10000000"))
+# С этого размера массив сортируется параллельно в пуле процессов (см. parallel_sort)
+PARALLEL_SORT_MIN_SIZE = int(os.environ.get("PARALLEL_SORT_MIN_SIZE", "2000000"))
+# Число частей при параллельной сортировке; 0 — по числу процессов пула (SORT_WORKERS)
+PARALLEL_SORT_WORKERS = int(os.environ.get("PARALLEL_SORT_WORKERS", "0"))
+
+
+# Гномья сортировка (эталонная реализация, O(n^2))
+def gnome_sort(arr: List[int]) -> List[int]:
+    index = 0
+    while index < len(arr):
+        if index == 0:
+            index += 1
+            if index >= len(arr):
+                break
+        if arr[index] >= arr[index - 1]:
+            index += 1
+        else:
+            arr[index], arr[index - 1] = arr[index - 1], arr[index]
+            index -= 1
+    return arr
+
+
+def timsort(arr: List[int]) -> List[int]:
+    arr.sort()
+    return arr
+
+
+# Сортировка подсчётом: O(n + k), где k — диапазон значений
+def counting_sort(arr: List[int]) -> List[int]:
+    if not arr:
+        return arr
+    low, high = min(arr), max(arr)
+    counts = [0] * (high - low + 1)
+    for value in arr:
+        counts[value - low] += 1
+    result = []
+    for offset, count in enumerate(counts):
+        if count:
+            result.extend([offset + low] * count)
+    return result
+
+
+# Поразрядная сортировка (LSD, основание 256) с поддержкой отрицательных чисел
+def radix_sort(arr: List[int]) -> List[int]:
+    if not arr:
+        return arr
+    low = min(arr)
+    shifted = [value - low for value in arr]
+    max_value = max(shifted)
+    shift = 0
+    while (max_value >> shift) > 0:
+        buckets = [[] for _ in range(256)]
+        for value in shifted:
+            buckets[(value >> shift) & 0xFF].append(value)
+        shifted = [value for bucket in buckets for value in bucket]
+        shift += 8
+    return [value + low for value in shifted]
+
+
+def numpy_sort(arr: List[int]) -> List[int]:
+    data = np.asarray(arr, dtype=np.int64)
+    data.sort(kind="stable")
+    return data.tolist()
+
+
+# Параллельная сортировка (sample sort) одного массива в пуле процессов.
+# Массив копируется в разделяемую память (int64), процессы подключаются к ней по имени
+# и работают с ней без копирования:
+# 1) каждый процесс сортирует на месте свою часть;
+# 2) из отсортированных частей берутся равномерные выборки, по ним выбираются
+#    workers - 1 разделителей, и каждая часть режется по ним бинарным поиском;
+# 3) процесс j сливает j-е куски всех частей в свой диапазон выходного буфера.
+# В пуле (вложенный вызов) и при одном процессе сортирует обычным numpy_sort.
+def parallel_sort(arr: List[int]) -> List[int]:
+    workers = _parallel_workers()
+    n = len(arr)
+    if workers < 2 or n < workers * workers:
+        return numpy_sort(arr)
+
+    source = shared_memory.SharedMemory(create=True, size=n * 8)
+    target = shared_memory.SharedMemory(create=True, size=n * 8)
+    try:
+        data = np.ndarray(n, dtype=np.int64, buffer=source.buf)
+        data[:] = arr
+        bounds = [n * i // workers for i in range(workers + 1)]
+        parts = list(zip(bounds, bounds[1:]))
+        pool = _get_pool()
+        for future in [pool.submit(_sort_part, source.name, n, start, end) for start, end in parts]:
+            future.result()
+
+        samples = np.sort(np.concatenate([
+            data[start:end][np.linspace(0, end - start - 1, workers).astype(np.intp)] for start, end in parts]))
+        splitters = samples[workers::workers]
+        edges = [[start, *(start + np.searchsorted(data[start:end], splitters, side='right')).tolist(), end]
+                 for start, end in parts]
+        del data
+
+        futures = []
+        offset = 0
+        for j in range(workers):
+            pieces = [(part_edges[j], part_edges[j + 1]) for part_edges in edges]
+            futures.append(pool.submit(_merge_pieces, source.name, target.name, n, pieces, offset))
+            offset += sum(end - start for start, end in pieces)
+        for future in futures:
+            future.result()
+
+        result = np.ndarray(n, dtype=np.int64, buffer=target.buf)
+        sorted_array = result.tolist()
+        del result
+        return sorted_array
+    finally:
+        for memory in (source, target):
+            try:
+                memory.close()
+            except BufferError:  # после исключения представления ещё живы в трассировке
+                pass
+            memory.unlink()
+
+
+def _parallel_workers() -> int:
+    if np is None or shared_memory is None or _in_pool:
+        return 0
+    return PARALLEL_SORT_WORKERS or SORT_WORKERS
+
+
+def _sort_part(name: str, n: int, start: int, end: int):
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        np.ndarray(n, dtype=np.int64, buffer=memory.buf)[start:end].sort()
+    finally:
+        memory.close()
+
+
+def _merge_pieces(source_name: str, target_name: str, n: int, pieces: List[tuple], offset: int):
+    source = shared_memory.SharedMemory(name=source_name)
+    target = shared_memory.SharedMemory(name=target_name)
+    try:
+        data = np.ndarray(n, dtype=np.int64, buffer=source.buf)
+        merged = np.concatenate([data[start:end] for start, end in pieces])
+        del data
+        # куски уже отсортированы: устойчивая сортировка (timsort) сливает готовые серии
+        merged.sort(kind="stable")
+        np.ndarray(n, dtype=np.int64, buffer=target.buf)[offset:offset + len(merged)] = merged
+    finally:
+        source.close()
+        target.close()
+
+
+SORT_ALGORITHMS: Dict[str, Callable[[List[int]], List[int]]] = {
+    "gnome": gnome_sort,
+    "timsort": timsort,
+    "counting": counting_sort,
+    "radix": radix_sort,
+}
+if np is not None:
+    SORT_ALGORITHMS["numpy"] = numpy_sort
+    if shared_memory is not None:
+        SORT_ALGORITHMS["parallel"] = parallel_sort
+
+
+def _fits_int64(low: int, high: int) -> bool:
+    return -(2 ** 63) <= low and high < 2 ** 63
+
+
+# Количество мест, где порядок нарушается (0 — массив уже отсортирован)
+def count_descents(arr: List[int]) -> int:
+    return sum(1 for i in range(1, len(arr)) if arr[i] < arr[i - 1])
+
+
+# Выбор алгоритма по размеру, диапазону значений и степени упорядоченности
+def choose_algorithm(arr: List[int]) -> str:
+    n = len(arr)
+    if n <= SMALL_ARRAY_SIZE:
+        return "gnome"
+    if count_descents(arr) <= n * PRESORTED_RUNS_RATIO:
+        return "timsort"
+    low, high = min(arr), max(arr)
+    if n >= COUNTING_MIN_SIZE and high - low <= min(n * COUNTING_MAX_RANGE_RATIO, COUNTING_MAX_RANGE):
+        return "counting"
+    if np is not None and n >= NUMPY_MIN_SIZE and _fits_int64(low, high):
+        if n >= PARALLEL_SORT_MIN_SIZE and "parallel" in SORT_ALGORITHMS and _parallel_workers() >= 2:
+            return "parallel"
+        return "numpy"
+    # radix sort на чистом Python медленнее встроенного timsort,
+    # поэтому автоматически не выбирается — только явно через algorithm
+    return "timsort"
+
+
+# Проверка, что алгоритм существует и применим к массиву (ValueError — ошибка запроса)
+def check_algorithm(arr: List[int], algorithm: str) -> None:
+    if algorithm not in SORT_ALGORITHMS:
+        raise ValueError(f"Unknown sort algorithm: {algorithm}. Available: {', '.join(SORT_ALGORITHMS)}")
+    if algorithm == "gnome" and len(arr) > GNOME_MAX_SIZE:
+        raise ValueError(f"gnome sort is limited to {GNOME_MAX_SIZE} elements")
+    if algorithm in ("counting", "numpy", "parallel") and arr:
+        low, high = min(arr), max(arr)
+        if algorithm == "counting" and high - low > COUNTING_MAX_RANGE:
+            raise ValueError(f"counting sort is limited to a value range of {COUNTING_MAX_RANGE}")
+        if algorithm != "counting" and not _fits_int64(low, high):
+            raise ValueError(f"Values do not fit into int64 for {algorithm} sort")
+
+
+# Сортирует массив выбранным (или автоматически подобранным) алгоритмом.
+# Возвращает отсортированный массив, имя алгоритма и время работы в миллисекундах.
+@metrics.timed("sort")
+def run_sort(arr: List[int], algorithm: Union[str, None] = None):
+    return _sort(arr, algorithm)
+
+
+# То же без замера фазы: выполняется в процессах пула, чьи метрики в /metrics не попадают.
+# Фазу "sort" по возвращённому времени отмечает основной процесс (_observe_sorts).
+def _sort(arr: List[int], algorithm: Union[str, None] = None):
+    if algorithm is None:
+        algorithm = choose_algorithm(arr)
+    check_algorithm(arr, algorithm)
+
+    started = time.perf_counter()
+    sorted_array = SORT_ALGORITHMS[algorithm](arr)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return sorted_array, algorithm, elapsed_ms
+
+
+# Вставка в отсортированный массив с сохранением порядка. Один элемент — бинарный поиск;
+# несколько — новые элементы сортируются и сливаются с массивом: timsort находит две
+# упорядоченные серии и сливает их за O(n + k log k) вместо k сдвигов списка по O(n).
+def insert_sorted(arr: List[int], elements: List[int]) -> List[int]:
+    if len(elements) == 1:
+        bisect.insort(arr, elements[0])
+        return arr
+    arr.extend(sorted(elements))
+    arr.sort()
+    return arr
+
+
+sort_cache = SortCache()
+
+
+# Проверки за один проход: уже отсортирован / отсортирован по убыванию
+def is_sorted(arr: List[int]) -> bool:
+    return all(arr[i] <= arr[i + 1] for i in range(len(arr) - 1))
+
+def is_reverse_sorted(arr: List[int]) -> bool:
+    return all(arr[i] >= arr[i + 1] for i in range(len(arr) - 1))
+
+
+# Быстрые пути без сортировки: упорядоченный вход или результат из кэша.
+# Возвращает (результат или None, ключ кэша или None).
+def _lookup(arr: List[int]):
+    started = time.perf_counter()
+    if is_sorted(arr):
+        return (arr, "presorted", (time.perf_counter() - started) * 1000), None
+    if is_reverse_sorted(arr):
+        arr.reverse()
+        return (arr, "reversed", (time.perf_counter() - started) * 1000), None
+    if len(arr) < SORT_CACHE_MIN_SIZE:
+        return None, None
+    key = array_key(arr)
+    cached = sort_cache.get(key)
+    if cached is not None:
+        return (cached, "cache", (time.perf_counter() - started) * 1000), key
+    return None, key
+
+
+# Сортировка с быстрыми путями и кэшем. Явно выбранный алгоритм всегда выполняется честно,
+# чтобы его можно было замерить. pooled=True — сама сортировка идёт в пуле процессов
+# и не занимает GIL основного процесса (для фоновых задач с большими массивами).
+# Параллельная сортировка сама раздаёт работу пулу, поэтому запускается из этого процесса.
+def cached_sort(arr: List[int], algorithm: Union[str, None] = None, pooled: bool = False):
+    parallel = algorithm == "parallel" or (algorithm is None and len(arr) >= PARALLEL_SORT_MIN_SIZE)
+    sort = _sort_in_pool if pooled and SORT_WORKERS >= 2 and not parallel else run_sort
+    if algorithm is not None:
+        return sort(arr, algorithm)
+    result, key = _lookup(arr)
+    if result is not None:
+        return result
+    result = sort(arr)
+    if key is not None:
+        sort_cache.put(key, result[0])
+    return result
+
+
+# Пул процессов для пакетной сортировки (по умолчанию — по процессу на ядро).
+# Как и пул bcrypt, запускается через forkserver, чтобы процессы не наследовали файлы с flock.
+SORT_WORKERS = int(os.environ.get("SORT_WORKERS", str(os.cpu_count() or 1)))
+
+_pool = None
+_in_pool = False  # True в процессах пула: вложенная параллельная сортировка там не запускается
+
+
+def _mark_pool_worker():
+    global _in_pool
+    _in_pool = True
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        context = multiprocessing.get_context("forkserver") if "forkserver" in multiprocessing.get_all_start_methods() else None
+        _pool = ProcessPoolExecutor(max_workers=SORT_WORKERS, mp_context=context, initializer=_mark_pool_worker)
+    return _pool
+
+
+def _observe_sorts(results) -> None:
+    for _, _, elapsed_ms in results:
+        metrics.observe_phase("sort", elapsed_ms / 1000)
+
+
+def _sort_in_pool(arr: List[int], algorithm: Union[str, None] = None):
+    result = _get_pool().submit(_sort, arr, algorithm).result()
+    _observe_sorts([result])
+    return result
+
+
+def _run_sort_batch(arrays: List[List[int]], algorithm: Union[str, None]):
+    return [_sort(arr, algorithm) for arr in arrays]
+
+
+# Сортирует много массивов параллельно. Массивы раздаются процессам пачками,
+# чтобы не платить за пересылку каждого маленького массива отдельно.
+# Результаты возвращаются в порядке входных массивов.
+# Быстрые пути и кэш проверяются в основном процессе, в пул уходят только промахи.
+def run_sort_many(arrays: List[List[int]], algorithm: Union[str, None] = None):
+    if algorithm is not None:
+        for arr in arrays:
+            check_algorithm(arr, algorithm)
+
+    results = [None] * len(arrays)
+    pending = []     # (индекс, ключ кэша)
+    duplicates = []  # (индекс, индекс такого же массива из pending)
+    first_by_key = {}
+    for i, arr in enumerate(arrays):
+        key = None
+        if algorithm is None:
+            results[i], key = _lookup(arr)
+            if results[i] is not None:
+                continue
+            if key is not None:
+                if key in first_by_key:
+                    duplicates.append((i, first_by_key[key]))
+                    continue
+                first_by_key[key] = i
+        pending.append((i, key))
+    if not pending:
+        return results
+
+    to_sort = [arrays[i] for i, _ in pending]
+    if len(to_sort) < 2 or SORT_WORKERS < 2:
+        sorted_results = _run_sort_batch(to_sort, algorithm)
+    else:
+        chunk_count = min(len(to_sort), SORT_WORKERS * 4)
+        chunk_size = -(-len(to_sort) // chunk_count)
+        chunks = [to_sort[i:i + chunk_size] for i in range(0, len(to_sort), chunk_size)]
+        sorted_results = []
+        for chunk_result in _get_pool().map(_run_sort_batch, chunks, [algorithm] * len(chunks)):
+            sorted_results.extend(chunk_result)
+    _observe_sorts(sorted_results)
+
+    for (i, key), result in zip(pending, sorted_results):
+        results[i] = result
+        if key is not None:
+            sort_cache.put(key, result[0])
+    for i, original in duplicates:
+        results[i] = (list(results[original][0]), "cache", 0.0)
+    return results
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
@@ -0,0 +1,221 @@
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Union
+import os
+import threading
+import time
+import uuid
+
+# Фоновые задачи сортировки
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))                      # одновременно выполняемых задач
+JOB_QUEUE_MAX = int(os.environ.get("JOB_QUEUE_MAX", "100"))                # задач в очереди всего
+JOB_QUEUE_USER_MAX = int(os.environ.get("JOB_QUEUE_USER_MAX", "10"))       # задач в очереди от одного пользователя
+JOB_QUEUE_MAX_ELEMENTS = int(os.environ.get("JOB_QUEUE_MAX_ELEMENTS", "20000000"))  # элементов в очереди всего
+JOB_MAX_ELEMENTS = int(os.environ.get("JOB_MAX_ELEMENTS", "10000000"))     # элементов в одном массиве
+JOB_INLINE_MAX_SIZE = int(os.environ.get("JOB_INLINE_MAX_SIZE", "10000"))  # меньшие массивы сортируются сразу
+JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", "600"))            # сколько секунд хранить результат
+JOB_RESULTS_MAX = int(os.environ.get("JOB_RESULTS_MAX", "1000"))           # сколько завершённых задач хранить
+JOB_RESULTS_MAX_ELEMENTS = int(os.environ.get("JOB_RESULTS_MAX_ELEMENTS", "20000000"))  # элементов во всех хранимых результатах
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+# Очередь переполнена — клиенту нужно повторить запрос позже (429)
+class QueueFull(Exception):
+    pass
+
+
+class SortJob:
+    def __init__(self, login: str, array, algorithm: Union[str, None]):
+        self.id = uuid.uuid4().hex
+        self.login = login
+        self.array = array
+        self.size = len(array)
+        self.algorithm = algorithm
+        self.status = QUEUED
+        self.result = None
+        self.position = None     # позиция результата в истории
+        self.elapsed_ms = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    def finish(self, result, algorithm: str, elapsed_ms: float, position: int):
+        self.result, self.algorithm, self.elapsed_ms, self.position = result, algorithm, elapsed_ms, position
+        self.status = DONE
+        self.finished = time.time()
+        self.array = None
+
+    def fail(self, error: str):
+        self.error = error
+        self.status = FAILED
+        self.finished = time.time()
+        self.array = None
+
+    def to_dict(self) -> dict:
+        data = {"job_id": self.id, "status": self.status, "user_login": self.login, "size": self.size}
+        if self.status == DONE:
+            data.update(algorithm=self.algorithm, elapsed_ms=self.elapsed_ms, history_index=self.position)
+            result = self.result
+            if result is not None:
+                data["sorted_array"] = result
+        elif self.status == FAILED:
+            data["error"] = self.error
+        return data
+
+
+# Планировщик задач: у каждого пользователя своя очередь, воркеры берут задачи
+# из очередей пользователей по кругу, поэтому много задач одного пользователя
+# не задерживают остальных. Очередь ограничена по числу задач (всего и на пользователя)
+# и по числу элементов; при переполнении submit бросает QueueFull.
+# run(job) выполняет задачу и возвращает (результат, алгоритм, мс, позиция в истории).
+class SortJobQueue:
+    def __init__(self, run: Callable[[SortJob], tuple], workers: int = JOB_WORKERS):
+        self.run = run
+        self.workers = workers
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._jobs: "OrderedDict[str, SortJob]" = OrderedDict()
+        self._finished: "OrderedDict[str, SortJob]" = OrderedDict()  # в порядке завершения
+        self.result_elements = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopped = False
+        self.queued = 0
+        self.queued_elements = 0
+        self.running = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+    def _start_workers(self):
+        if self._threads:
+            return
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, login: str, array, algorithm: Union[str, None]) -> SortJob:
+        job = SortJob(login, array, algorithm)
+        with self._cond:
+            if self._stopped:
+                raise QueueFull("Job queue is shutting down")
+            user_queue = self._queues.get(login)
+            if self.queued >= JOB_QUEUE_MAX or self.queued_elements + job.size > JOB_QUEUE_MAX_ELEMENTS:
+                self.rejected += 1
+                raise QueueFull("Job queue is full")
+            if user_queue is not None and len(user_queue) >= JOB_QUEUE_USER_MAX:
+                self.rejected += 1
+                raise QueueFull("Too many queued jobs for this user")
+            if user_queue is None:
+                user_queue = self._queues[login] = deque()
+            user_queue.append(job)
+            self.queued += 1
+            self.queued_elements += job.size
+            self._jobs[job.id] = job
+            self._start_workers()
+            self._cond.notify()
+        return job
+
+    # Задача, выполненная сразу в обработчике запроса (быстрый путь для маленьких массивов)
+    def add_completed(self, job: SortJob):
+        with self._cond:
+            self.completed += 1
+            self._retire(job)
+
+    def get(self, job_id: str) -> Union[SortJob, None]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    # Хранятся все незавершённые задачи и последние JOB_RESULTS_MAX завершённых не старше JOB_RESULT_TTL.
+    # Отсортированные массивы хранятся, пока их суммарный размер не больше JOB_RESULTS_MAX_ELEMENTS;
+    # у более старых задач остаётся history_index — результат уже сохранён в истории.
+    # Вызывается под self._cond.
+    def _retire(self, job: SortJob):
+        self._jobs[job.id] = job
+        self._finished[job.id] = job
+        if job.result is not None:
+            self.result_elements += len(job.result)
+        now = time.time()
+        while self._finished:
+            old = next(iter(self._finished.values()))
+            if len(self._finished) <= JOB_RESULTS_MAX and now - old.finished <= JOB_RESULT_TTL:
+                break
+            del self._finished[old.id]
+            del self._jobs[old.id]
+            self._drop_result(old)
+        for old in self._finished.values():
+            if self.result_elements <= JOB_RESULTS_MAX_ELEMENTS:
+                break
+            self._drop_result(old)
+
+    def _drop_result(self, job: SortJob):
+        if job.result is not None:
+            self.result_elements -= len(job.result)
+            job.result = None
+
+    # Следующая задача: первый пользователь в круге, после него он уходит в конец
+    def _next(self) -> Union[SortJob, None]:
+        with self._cond:
+            while not self._queues and not self._stopped:
+                self._cond.wait()
+            if self._stopped:
+                return None
+            login, user_queue = next(iter(self._queues.items()))
+            job = user_queue.popleft()
+            if user_queue:
+                self._queues.move_to_end(login)
+            else:
+                del self._queues[login]
+            self.queued -= 1
+            self.queued_elements -= job.size
+            self.running += 1
+            job.status = RUNNING
+            return job
+
+    def _work(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            try:
+                job.finish(*self.run(job))
+            except Exception as e:
+                job.fail(str(getattr(e, "detail", e)))
+            with self._cond:
+                self.running -= 1
+                if job.status == DONE:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self._retire(job)
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "queued": self.queued,
+                "queued_elements": self.queued_elements,
+                "running": self.running,
+                "users": len(self._queues),
+                "max_queued": JOB_QUEUE_MAX,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "retained": len(self._finished),
+                "retained_elements": self.result_elements,
+            }
+
+    # Остановка: выполняемые задачи дорабатывают, ожидающие в очереди отменяются
+    def shutdown(self):
+        with self._cond:
+            self._stopped = True
+            for user_queue in self._queues.values():
+                for job in user_queue:
+                    job.fail("Server is shutting down")
+            self._queues.clear()
+            self.queued = self.queued_elements = 0
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
@@ -0,0 +1,202 @@
+from typing import Iterator, List, Union
+import json
+import sqlite3
+import threading
+from storage import UserBackend, HistoryBackend, UserExists
+from lock_manager import LockManager
+from metrics import metrics
+from history_codec import encode_array, decode_array, summarize_array
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    login TEXT NOT NULL UNIQUE,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS history (
+    login TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    summary TEXT,
+    array BLOB NOT NULL,
+    PRIMARY KEY (login, position)
+) WITHOUT ROWID;
+"""
+
+# Сколько строк читать за раз при потоковой отдаче истории
+STREAM_BATCH = 256
+
+
+# Массив хранится в BLOB (history_codec); строки, записанные до сжатия, — JSON-текст
+def _decode(value) -> List[int]:
+    return json.loads(value) if isinstance(value, str) else decode_array(value)
+
+
+# Сводка массива для статистики — JSON [длина, минимум, максимум, сумма]
+# (значения могут не помещаться в INTEGER SQLite)
+def _summary(array: List[int]) -> str:
+    return json.dumps(summarize_array(array))
+
+
+# Соединения с базой SQLite в режиме WAL: по соединению на поток,
+# читатели не блокируют писателя и друг друга
+class SqliteDatabase:
+    def __init__(self, path: str = 'storage.db'):
+        self.path = path
+        self._local = threading.local()
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+            # Базы до появления сводок: столбец добавляется, сводки заполняются при чтении
+            if "summary" not in [row[1] for row in conn.execute("PRAGMA table_info(history)")]:
+                try:
+                    conn.execute("ALTER TABLE history ADD COLUMN summary TEXT")
+                except sqlite3.OperationalError:  # столбец уже добавил другой воркер
+                    pass
+
+    def connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=check_same_thread)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+        return conn
+
+
+class SqliteUserStore(UserBackend):
+    def __init__(self, db: SqliteDatabase):
+        self.db = db
+
+    def exists(self, login: str) -> bool:
+        return self.db.conn.execute("SELECT 1 FROM users WHERE login = ?", (login,)).fetchone() is not None
+
+    @metrics.timed("user_lookup")
+    def get(self, login: str) -> Union[dict, None]:
+        row = self.db.conn.execute("SELECT data FROM users WHERE login = ?", (login,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @metrics.timed("user_write")
+    def add(self, user: dict):
+        try:
+            with self.db.conn as conn:
+                conn.execute("INSERT INTO users (id, login, data) VALUES (?, ?, ?)",
+                             (user['id'], user['login'], json.dumps(user)))
+        except sqlite3.IntegrityError:
+            raise UserExists(user['login'])
+
+    @metrics.timed("user_write")
+    def save(self, user: dict):
+        with self.db.conn as conn:
+            cursor = conn.execute("UPDATE users SET data = ? WHERE login = ?", (json.dumps(user), user['login']))
+        if cursor.rowcount == 0:
+            raise KeyError(user['login'])
+
+
+# История в таблице history с первичным ключом (login, position):
+# срезы, чтение и удаление по позиции — запросы по индексу.
+class SqliteHistoryStore(HistoryBackend):
+    def __init__(self, db: SqliteDatabase, locks: Union[LockManager, None] = None):
+        self.db = db
+        self.locks = locks or LockManager(db.path + '.locks')
+
+    def _next_position(self, conn, login: str) -> int:
+        row = conn.execute("SELECT MAX(position) FROM history WHERE login = ?", (login,)).fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    @metrics.timed("history_read")
+    def count(self, login: str) -> Union[int, None]:
+        row = self.db.conn.execute("SELECT MAX(position) FROM history WHERE login = ?", (login,)).fetchone()
+        return None if row[0] is None else row[0] + 1
+
+    @metrics.timed("history_write")
+    def append(self, login: str, array: List[int]) -> int:
+        return self.extend(login, [array])
+
+    @metrics.timed("history_write")
+    def extend(self, login: str, arrays: List[List[int]]) -> int:
+        with self.locks.write(login), self.db.conn as conn:
+            first = self._next_position(conn, login)
+            conn.executemany("INSERT INTO history (login, position, array, summary) VALUES (?, ?, ?, ?)",
+                             ((login, first + i, encode_array(array), _summary(array))
+                              for i, array in enumerate(arrays)))
+        return first
+
+    @metrics.timed("history_read")
+    def read_range(self, login: str, start: int, end: int) -> List[List[int]]:
+        rows = self.db.conn.execute(
+            "SELECT array FROM history WHERE login = ? AND position >= ? AND position < ? ORDER BY position",
+            (login, start, end)).fetchall()
+        return [_decode(row[0]) for row in rows]
+
+    # Отдельное соединение: при потоковой отдаче генератор продолжается в разных потоках
+    def iter_all(self, login: str, start: int = 0, end: Union[int, None] = None) -> Iterator[List[int]]:
+        conn = self.db.connect(check_same_thread=False)
+        try:
+            cursor = conn.execute(
+                "SELECT array FROM history WHERE login = ? AND position >= ? AND position < ? ORDER BY position",
+                (login, start, end if end is not None else 2 ** 62))
+            while True:
+                rows = cursor.fetchmany(STREAM_BATCH)
+                if not rows:
+                    break
+                for row in rows:
+                    yield _decode(row[0])
+        finally:
+            conn.close()
+
+    @metrics.timed("history_read")
+    def read_all(self, login: str) -> List[List[int]]:
+        return list(self.iter_all(login))
+
+    # Сводки из столбца summary; строки без сводки (записанные до её появления)
+    # читаются один раз, и сводка сохраняется
+    @metrics.timed("history_read")
+    def summaries(self, login: str) -> List[tuple]:
+        with self.locks.read(login):
+            rows = self.db.conn.execute(
+                "SELECT position, summary FROM history WHERE login = ? ORDER BY position", (login,)).fetchall()
+            summaries, missing = [], []
+            for position, summary in rows:
+                if summary is None:
+                    summary = _summary(self.get(login, position))
+                    missing.append((summary, login, position))
+                summaries.append(tuple(json.loads(summary)))
+            if missing:
+                with self.db.conn as conn:
+                    conn.executemany("UPDATE history SET summary = ? WHERE login = ? AND position = ?", missing)
+            return summaries
+
+    @metrics.timed("history_write")
+    def replace(self, login: str, position: int, array: List[int]) -> None:
+        with self.locks.write(login), self.db.conn as conn:
+            conn.execute("UPDATE history SET array = ?, summary = ? WHERE login = ? AND position = ?",
+                         (encode_array(array), _summary(array), login, position))
+
+    @metrics.timed("history_write")
+    def delete(self, login: str, position: int) -> List[int]:
+        with self.locks.write(login), self.db.conn as conn:
+            row = conn.execute("SELECT array FROM history WHERE login = ? AND position = ?",
+                               (login, position)).fetchone()
+            if row is None:
+                raise IndexError(position)
+            conn.execute("DELETE FROM history WHERE login = ? AND position = ?", (login, position))
+            # Сдвиг позиций в два шага, чтобы не нарушать первичный ключ по ходу обновления
+            conn.execute("UPDATE history SET position = -position WHERE login = ? AND position > ?", (login, position))
+            conn.execute("UPDATE history SET position = -position - 1 WHERE login = ? AND position < 0", (login,))
+        return _decode(row[0])
+
+    @metrics.timed("history_write")
+    def delete_all(self, login: str) -> bool:
+        with self.locks.write(login), self.db.conn as conn:
+            cursor = conn.execute("DELETE FROM history WHERE login = ?", (login,))
+        return cursor.rowcount > 0
+
+    @metrics.timed("history_write")
+    def rewrite(self, login: str, arrays: List[List[int]]) -> None:
+        with self.locks.write(login), self.db.conn as conn:
+            conn.execute("DELETE FROM history WHERE login = ?", (login,))
+            conn.executemany("INSERT INTO history (login, position, array, summary) VALUES (?, ?, ?, ?)",
+                             ((login, i, encode_array(array), _summary(array)) for i, array in enumerate(arrays)))
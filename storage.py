@@ -0,0 +1,131 @@
+from contextlib import contextmanager
+from typing import Iterator, List, Union
+import hashlib
+import json
+import os
+
+# Сколько шестнадцатеричных символов хеша логина задают подкаталог (2 — 256 подкаталогов)
+SHARD_DIGITS = 2
+
+
+def load_json(file_path: str):
+    try:
+        with open(file_path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def save_json(file_path: str, data):
+    with open(file_path, 'w') as f:
+        json.dump(data, f)
+
+
+# Подкаталог пользователя: users/ и history/ делятся на подкаталоги по префиксу хеша логина,
+# чтобы в одном каталоге не лежали миллионы файлов
+def shard(login: str) -> str:
+    return hashlib.blake2b(login.encode(), digest_size=8).hexdigest()[:SHARD_DIGITS]
+
+# Файлы каталога и его подкаталогов-шардов (пути относительно folder).
+# Служебные каталоги и файлы (с точкой или подчёркиванием в начале) пропускаются.
+def iter_shard_files(folder: str) -> Iterator[str]:
+    if not os.path.isdir(folder):
+        return
+    for name in os.listdir(folder):
+        if name.startswith(('.', '_')):
+            continue
+        path = os.path.join(folder, name)
+        if os.path.isdir(path):
+            for file in os.listdir(path):
+                yield os.path.join(name, file)
+        else:
+            yield name
+
+
+# Логин уже занят (UserBackend.add)
+class UserExists(Exception):
+    pass
+
+
+# Интерфейсы хранилищ. Реализации: файлы (user_store.UserStore, history_store.HistoryStore)
+# и SQLite (sqlite_store.SqliteUserStore, sqlite_store.SqliteHistoryStore).
+
+class UserBackend:
+    # Подготовка хранилища при старте приложения
+    def load(self) -> None:
+        pass
+
+    def exists(self, login: str) -> bool:
+        raise NotImplementedError
+
+    # Запись пользователя или None
+    def get(self, login: str) -> Union[dict, None]:
+        raise NotImplementedError
+
+    # Проверка логина и добавление атомарны: занятый логин — UserExists
+    def add(self, user: dict) -> None:
+        raise NotImplementedError
+
+    def save(self, user: dict) -> None:
+        raise NotImplementedError
+
+
+class HistoryBackend:
+    locks = None
+
+    # Блокировки пользователя для последовательностей операций в обработчиках
+    @contextmanager
+    def reading(self, login: str):
+        with self.locks.read(login):
+            yield
+
+    @contextmanager
+    def writing(self, login: str):
+        with self.locks.write(login):
+            yield
+
+    # Количество массивов в истории (None, если истории нет)
+    def count(self, login: str) -> Union[int, None]:
+        raise NotImplementedError
+
+    # Добавление массива, возвращает его позицию
+    def append(self, login: str, array: List[int]) -> int:
+        raise NotImplementedError
+
+    # Добавление нескольких массивов, возвращает позицию первого
+    def extend(self, login: str, arrays: List[List[int]]) -> int:
+        raise NotImplementedError
+
+    def read_range(self, login: str, start: int, end: int) -> List[List[int]]:
+        raise NotImplementedError
+
+    # Ленивое чтение, пригодное для потоковой отдачи
+    def iter_all(self, login: str, start: int = 0, end: Union[int, None] = None) -> Iterator[List[int]]:
+        raise NotImplementedError
+
+    def read_all(self, login: str) -> List[List[int]]:
+        return list(self.iter_all(login))
+
+    # Сводки массивов (history_codec.summarize_array) в порядке истории — без чтения самих массивов
+    def summaries(self, login: str) -> List[tuple]:
+        raise NotImplementedError
+
+    def get(self, login: str, position: int) -> List[int]:
+        return self.read_range(login, position, position + 1)[0]
+
+    def replace(self, login: str, position: int, array: List[int]) -> None:
+        raise NotImplementedError
+
+    # Удаление массива, возвращает удалённый массив
+    def delete(self, login: str, position: int) -> List[int]:
+        raise NotImplementedError
+
+    # Удаление всей истории, False — если её не было
+    def delete_all(self, login: str) -> bool:
+        raise NotImplementedError
+
+    # Замена всей истории пользователя списком arrays
+    def rewrite(self, login: str, arrays: List[List[int]]) -> None:
+        raise NotImplementedError
+
+    def shutdown(self) -> None:
+        pass
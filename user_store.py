@@ -0,0 +1,165 @@
+from contextlib import contextmanager
+from typing import Dict, Union
+import json
+import os
+import threading
+from storage import load_json, save_json, shard, iter_shard_files, UserBackend, UserExists
+from metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: регистрация защищена только внутри одного процесса
+    fcntl = None
+
+
+# Пользователи лежат в users/{shard}/user_{id}.json ({shard} — префикс хеша логина).
+# Индекс пользователей: login -> путь к файлу пользователя относительно users/.
+# Хранится в памяти и дублируется в журнале users/_index.jsonl (по строке на пользователя),
+# поэтому регистрация дописывает одну строку, а поиск по логину не читает весь каталог.
+class UserStore(UserBackend):
+    def __init__(self, folder_path: str = 'users/'):
+        self.folder_path = folder_path
+        self.index_path = os.path.join(folder_path, '_index.jsonl')
+        self.index: Dict[str, str] = {}
+        self._index_offset = 0  # сколько байт журнала уже прочитано
+        self._index_inode = None  # inode прочитанного журнала: перестроение заменяет файл
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _user_files(self):
+        return [f for f in iter_shard_files(self.folder_path)
+                if os.path.basename(f).startswith('user_') and f.endswith('.json')]
+
+    # Дочитывает новые строки журнала (например, добавленные другим воркером).
+    # Если журнал перестроен другим процессом (сменился inode), он читается с начала.
+    def _read_index_tail(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'rb') as f:
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self._index_inode:
+                self._index_inode = inode
+                self._index_offset = 0
+            f.seek(self._index_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # строка ещё дописывается
+                self._index_offset += len(line)
+                entry = json.loads(line)
+                self.index[entry['login']] = entry['file']
+
+    # Журнал индекса, открытый на дозапись под flock (блокировка между воркерами).
+    # Перестроение заменяет файл, поэтому после захвата проверяется, что заблокирован
+    # текущий журнал, а не уже заменённый; иначе блокировка берётся заново.
+    @contextmanager
+    def _index_locked(self):
+        while True:
+            f = open(self.index_path, 'a')
+            try:
+                if fcntl is None:
+                    break
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(f.fileno()).st_ino == os.stat(self.index_path).st_ino:
+                        break
+                except FileNotFoundError:
+                    pass
+            except BaseException:
+                f.close()
+                raise
+            f.close()
+        with f:
+            yield f
+
+    # Полное перестроение индекса сканированием каталога.
+    # Вызывается под блокировкой журнала (_index_locked).
+    def rebuild(self):
+        index = {}
+        for file in self._user_files():
+            user = load_json(os.path.join(self.folder_path, file))
+            if user and 'login' in user:
+                index[user['login']] = file
+
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            for login, file in index.items():
+                f.write(json.dumps({"login": login, "file": file}) + '\n')
+        os.replace(tmp_path, self.index_path)
+
+        self.index = index
+        stat = os.stat(self.index_path)
+        self._index_inode = stat.st_ino
+        self._index_offset = stat.st_size
+
+    # Журнал совпадает с файлами пользователей в каталоге
+    def _index_valid(self) -> bool:
+        self.index = {}
+        self._index_offset = 0
+        self._index_inode = None
+        try:
+            self._read_index_tail()
+            return set(self.index.values()) == set(self._user_files())
+        except (json.JSONDecodeError, KeyError):
+            return False
+
+    # Загрузка индекса при старте: читаем журнал и сверяем его с файлами в каталоге.
+    # Перестраивает журнал один воркер под блокировкой; остальные после её получения
+    # проверяют журнал заново и используют уже перестроенный.
+    def load(self):
+        with self._lock:
+            os.makedirs(self.folder_path, exist_ok=True)
+            if not self._index_valid():
+                with self._index_locked():
+                    if not self._index_valid():
+                        self.rebuild()
+            self._loaded = True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def _find(self, login: str) -> Union[str, None]:
+        self._ensure_loaded()
+        file = self.index.get(login)
+        if file is None:
+            with self._lock:
+                self._read_index_tail()
+            file = self.index.get(login)
+        return file
+
+    def exists(self, login: str) -> bool:
+        return self._find(login) is not None
+
+    # Возвращает запись пользователя или None
+    @metrics.timed("user_lookup")
+    def get(self, login: str) -> Union[dict, None]:
+        file = self._find(login)
+        if file is None:
+            return None
+        return load_json(os.path.join(self.folder_path, file))
+
+    # Проверка логина и запись идут под блокировкой журнала индекса (flock — между воркерами),
+    # поэтому одновременные регистрации одного логина не создают двух пользователей
+    @metrics.timed("user_write")
+    def add(self, user: dict):
+        self._ensure_loaded()
+        user_shard = shard(user['login'])
+        os.makedirs(os.path.join(self.folder_path, user_shard), exist_ok=True)
+        file = os.path.join(user_shard, f"user_{user['id']}.json")
+        with self._lock:
+            with self._index_locked() as f:
+                self._read_index_tail()
+                if user['login'] in self.index:
+                    raise UserExists(user['login'])
+                save_json(os.path.join(self.folder_path, file), user)
+                f.write(json.dumps({"login": user['login'], "file": file}) + '\n')
+                f.flush()
+                self._index_offset = f.tell()
+            self.index[user['login']] = file
+
+    @metrics.timed("user_write")
+    def save(self, user: dict):
+        file = self._find(user['login'])
+        if file is None:
+            raise KeyError(user['login'])
+        save_json(os.path.join(self.folder_path, file), user)